@@ -0,0 +1,73 @@
+"""File server requests/sec with Basic auth off and on, credentials are read from the env file once per change.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_auth.py --clients 8 --requests 500
+"""
+import os
+import time
+import base64
+import argparse
+import tempfile
+import threading
+import http.client
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ove_jupyter_utils.file_server import ThreadedHTTPServer, handler_from
+
+
+def client(port: int, requests: int, headers: dict) -> int:
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        for _ in range(requests):
+            # a video player asking for the next Range chunk
+            connection.request("GET", "/video.mp4", headers={"Range": "bytes=0-4095", **headers})
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 206, response.status
+        return requests
+    finally:
+        connection.close()
+
+
+def run(directory: str, env: str, headers: dict, args: argparse.Namespace) -> float:
+    handler = handler_from(directory, False, env)
+    handler.log_message = lambda *_: None
+    server = ThreadedHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            served = sum(executor.map(lambda _: client(port, args.requests, headers), range(args.clients)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    return served / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="requests per client")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(1024 * 1024))
+        off = os.path.join(directory, "off.env")
+        with open(off, "w") as f:
+            f.write("OVE_CORE=http://127.0.0.1:8080\n")
+        on = os.path.join(directory, "on.env")
+        with open(on, "w") as f:
+            f.write("OVE_CORE=http://127.0.0.1:8080\nOVE_USERNAME=wall\nOVE_PASSWORD=secret\n")
+        token = base64.b64encode(b"wall:secret").decode("ascii")
+
+        print(f"{'auth':>5} {'requests/s':>11}")
+        print(f"{'off':>5} {run(directory, off, {}, args):>11.0f}")
+        print(f"{'on':>5} {run(directory, on, {'Authorization': f'Basic {token}'}, args):>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
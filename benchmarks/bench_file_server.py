@@ -0,0 +1,93 @@
+"""File server throughput for concurrent full and Range fetches of large media files, sendfile against buffered copy.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_file_server.py --size 64 --clients 16
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+import http.client
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ove_jupyter_utils.file_server import ThreadedHTTPServer, handler_from
+
+
+def drain(response: http.client.HTTPResponse) -> int:
+    # reads into one reusable buffer so the client side costs as little as possible
+    buffer = memoryview(bytearray(1024 * 1024))
+    received = 0
+    while True:
+        n = response.readinto(buffer)
+        if n == 0:
+            return received
+        received += n
+
+
+def fetch(port: int, path: str, size: int, chunk: int, ranged: bool) -> int:
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    received = 0
+    try:
+        if not ranged:
+            connection.request("GET", path)
+            return drain(connection.getresponse())
+        # a media player walking the file in Range chunks
+        for start in range(0, size, chunk):
+            connection.request("GET", path, headers={"Range": f"bytes={start}-{min(size, start + chunk) - 1}"})
+            received += drain(connection.getresponse())
+            connection.close()
+        return received
+    finally:
+        connection.close()
+
+
+def run(directory: str, env: str, files: list[str], size: int, args: argparse.Namespace, use_sendfile: bool,
+        ranged: bool) -> float:
+    handler = handler_from(directory, False, env)
+    handler.use_sendfile = use_sendfile
+    handler.log_message = lambda *_: None
+    server = ThreadedHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            received = sum(executor.map(lambda i: fetch(port, f"/{files[i % len(files)]}", size, args.chunk * 2 ** 20,
+                                                        ranged), range(args.clients * args.fetches)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    return received / elapsed / 2 ** 20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64, help="file size in MiB")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--fetches", type=int, default=2, help="fetches per client")
+    parser.add_argument("--chunk", type=int, default=8, help="Range chunk in MiB")
+    args = parser.parse_args()
+
+    size = args.size * 2 ** 20
+    with tempfile.TemporaryDirectory() as directory:
+        env = os.path.join(directory, ".env")
+        open(env, "w").close()
+        files = []
+        for i in range(args.files):
+            files.append(f"video-{i}.mp4")
+            with open(os.path.join(directory, files[-1]), "wb") as f:
+                f.write(os.urandom(size))
+
+        print(f"{'request':>8} {'buffered (MiB/s)':>17} {'sendfile (MiB/s)':>17}")
+        for ranged in (False, True):
+            buffered = run(directory, env, files, size, args, False, ranged)
+            sendfile = run(directory, env, files, size, args, True, ranged)
+            print(f"{'range' if ranged else 'full':>8} {buffered:>17.0f} {sendfile:>17.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Peak memory and time of OVEMagic.format_ipython for a cell displaying many large PNGs or GeoJSON outputs, against
+the deepcopy it replaced. Strings are immutable so deepcopy shares them, what it copied was every dict and list, which
+for JSON and GeoJSON outputs is the whole document.
+
+Run from the repository root with both packages installed:
+    python benchmarks/bench_format_ipython.py --outputs 50 --size 4194304
+"""
+import os
+import copy
+import time
+import base64
+import argparse
+import tracemalloc
+
+from IPython.utils.capture import CapturedIO
+
+from ove_jupyter.ove_magic import OVEMagic
+from ove_jupyter.ipython_display_type import IPythonDisplayType, to_data_type
+
+
+def deepcopy_format(io: CapturedIO) -> list[tuple]:
+    # the previous OVEMagic.format_ipython, without the injected outputs
+    formatted_outputs = []
+    for output_idx, output_ in enumerate(io._outputs):
+        output = copy.deepcopy(output_)
+        display_mode = IPythonDisplayType.from_ipython_output(io._outputs[output_idx])
+        if display_mode is not None:
+            output = display_mode.format_ipython_output(output)
+        output["data"] = {k: v for k, v in output["data"].items() if "text/plain" not in k}
+        for output_type, data in output["data"].items():
+            formatted_outputs.append((str(output_idx), to_data_type(display_mode, output_type, data).value, data,
+                                      output["metadata"].get(output_type, None)))
+    return formatted_outputs
+
+
+def make_png(size: int) -> dict:
+    # what capture_output records for a matplotlib figure
+    return {"image/png": base64.b64encode(os.urandom(size)).decode("ascii"),
+            "text/plain": "<Figure size 640x480 with 1 Axes>"}
+
+
+def make_geojson(size: int) -> dict:
+    # roughly size bytes of polygons once serialised
+    features = [{"type": "Feature", "properties": {"name": f"feature {i}"},
+                 "geometry": {"type": "Polygon", "coordinates": [[[i, 0], [i + 1, 0], [i + 1, 1], [i, 0]]]}}
+                for i in range(max(1, size // 150))]
+    return {"application/geo+json": {"type": "FeatureCollection", "features": features},
+            "text/plain": "<IPython.display.GeoJSON object>"}
+
+
+def make_io(make_data, n: int, size: int) -> CapturedIO:
+    outputs = [{"data": make_data(size), "metadata": {}, "transient": {}, "update": False} for _ in range(n)]
+    return CapturedIO("", "", outputs)
+
+
+def measure(fn, io: CapturedIO) -> tuple[float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(io)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outputs", type=int, default=50)
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="decoded bytes per PNG output")
+    args = parser.parse_args()
+
+    magic = OVEMagic(None)
+    print(f"{'output':>8} {'version':>10} {'time (ms)':>10} {'peak (MiB)':>11}")
+    for kind, make_data, size in (("png", make_png, args.size), ("geojson", make_geojson, args.size // 16)):
+        io = make_io(make_data, args.outputs, size)
+        for name, fn in (("deepcopy", deepcopy_format), ("views", magic.format_ipython)):
+            elapsed, peak = measure(fn, io)
+            print(f"{kind:>8} {name:>10} {elapsed * 1e3:>10.2f} {peak / 2 ** 20:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
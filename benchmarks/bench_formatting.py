@@ -0,0 +1,58 @@
+"""Per-output OutputFormatter cost with the template cache against the previous read-and-replace path.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_formatting.py --number 2000
+"""
+import json
+import timeit
+import argparse
+
+from ove_jupyter_utils.utils import get_dir
+from ove_jupyter_utils.file_handler import FileHandler
+from ove_jupyter_utils.output_formatter import OutputFormatter
+
+
+def read_outline(name: str) -> str:
+    # the previous FileHandler.read_file
+    with open(f"{get_dir()}/assets/{name}") as f:
+        return "".join(f.readlines())
+
+
+def legacy(name: str, **values: str):
+    outline = read_outline(name)
+    for k, v in values.items():
+        outline = outline.replace(f"%%{k}%%", v)
+    return outline
+
+
+def cached(formatter: OutputFormatter, name: str, **values: str):
+    return formatter.get_template(name).substitute(**values)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    formatter = OutputFormatter(FileHandler(), None)
+    html = "<table>" + "<tr><td>1</td><td>2</td></tr>" * 200 + "</table>"
+    geojson = json.dumps({"type": "FeatureCollection", "features": []})
+    cases = {
+        "html": ("html_format.html", {"replace": html}),
+        "dataframe": ("dataframe_format.html", {"replace": html}),
+        "json": ("dict_format.html", {"replace": json.dumps({"a": list(range(100))}, indent=4)}),
+        "geojson": ("geojson_format.json", {"basemap": "https://tiles/{z}/{x}/{y}.png", "geojson": geojson}),
+        "latex (outline only)": ("latex_format.html", {"replace": "<p>x</p>"}),
+        "markdown (outline only)": ("markdown_format.html", {"replace": "<p>x</p>"}),
+    }
+
+    print(f"{'output':>24} {'before (us)':>12} {'after (us)':>11} {'speedup':>8}")
+    for name, (template, values) in cases.items():
+        assert legacy(template, **values) == cached(formatter, template, **values)
+        before = timeit.timeit(lambda: legacy(template, **values), number=args.number) / args.number * 1e6
+        after = timeit.timeit(lambda: cached(formatter, template, **values), number=args.number) / args.number * 1e6
+        print(f"{name:>24} {before:>12.1f} {after:>11.1f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Peak memory and time of writing a base64 PNG output, in memory decode against the streamed decode.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_image_decode.py --sizes 8 32 128
+"""
+import os
+import time
+import base64
+import argparse
+import tempfile
+import tracemalloc
+
+from ove_jupyter_utils.data_type import DataType
+from ove_jupyter_utils.file_handler import FileHandler
+from ove_jupyter_utils.asset_handler import AssetHandler
+
+
+def in_memory(data: str, out: str) -> None:
+    # the previous AssetHandler._format_asset + FileHandler.to_file
+    FileHandler().to_file(base64.b64decode(data), f"{out}/cell-1-0.png", "wb")
+
+
+def streamed(data: str, out: str) -> None:
+    AssetHandler(out, "http://localhost", FileHandler()).write_asset(data, 1, 0, DataType.PNG)
+
+
+def measure(fn, data: str, out: str) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(data, out)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[8, 32, 128], help="decoded image sizes in MiB")
+    args = parser.parse_args()
+
+    print(f"{'image (MiB)':>11} {'before peak (MiB)':>18} {'after peak (MiB)':>17} {'before (s)':>11} {'after (s)':>10}")
+    for size in args.sizes:
+        # wrapped at 76 characters like MIME encoded payloads
+        data = base64.encodebytes(os.urandom(size * 2 ** 20)).decode("ascii")
+        with tempfile.TemporaryDirectory() as out:
+            before_peak, before = measure(in_memory, data, out)
+            expected = open(f"{out}/cell-1-0.png", "rb").read()
+            after_peak, after = measure(streamed, data, out)
+            assert open(f"{out}/cell-1-0.png", "rb").read() == expected
+        print(f"{size:>11} {before_peak:>18.1f} {after_peak:>17.1f} {before:>11.3f} {after:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Renderer round-trips when a cell is re-run, recorded by the stub renderer.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_section_replace.py --outputs 12
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+from ove_jupyter_utils.stub_server import StubServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_tee_pipeline import make_handler, make_outputs, cell_config  # noqa: E402
+
+
+def rerun(handler, stub: StubServer, outputs: list[list]) -> int:
+    stub.reset()
+    handler.tee(cell_config(1), outputs)
+    return sum(stub.requests.values())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outputs", type=int, default=12)
+    parser.add_argument("--size", type=int, default=16 * 1024)
+    args = parser.parse_args()
+    k = args.outputs
+
+    with tempfile.TemporaryDirectory() as out, StubServer() as stub:
+        handler = make_handler(stub, out, pipeline=False, workers=1)
+        outputs = make_outputs(k, args.size)
+
+        # (name, outputs, expected requests, requests made by per-output DELETE + POST)
+        scenarios = [
+            ("first run", outputs, k, k),
+            ("unchanged re-run", outputs, 0, 2 * k),
+            ("one output changed", outputs[:-1] + make_outputs(1, args.size), 1, 2 * k),
+            # the remaining sections are resized so each is updated, the rest are deleted
+            ("half the outputs removed", outputs[:k // 2], k, k),
+        ]
+        for name, cell_outputs, expected, previously in scenarios:
+            count = rerun(handler, stub, cell_outputs)
+            print(f"{name:>26}: {count:>4} requests (expected {expected}, previously {previously})")
+            assert count == expected, dict(stub.requests)
+        assert len(stub.sections) == k // 2
+
+        # the session keeps its connections alive, so the requests above share a few instead of opening one each
+        connections = handler.handler.get_connection_stats()
+        print(f"{connections['requests']} requests over {connections['connections']} connection(s)")
+        assert connections["connections"] < connections["requests"], connections
+
+
+if __name__ == "__main__":
+    main()
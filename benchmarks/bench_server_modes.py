@@ -0,0 +1,119 @@
+"""Threaded against asyncio file server: requests/sec and server threads with many keep-alive clients.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_server_modes.py --clients 200
+"""
+import os
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import http.client
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ove_jupyter_utils.async_server import AsyncServer
+from ove_jupyter_utils.file_server import ThreadedHTTPServer, handler_from
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def client(port: int, requests: int, barrier: threading.Barrier) -> int:
+    # a wall browser, one keep-alive connection reused for every asset
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        connection.request("GET", "/asset.png")
+        connection.getresponse().read()
+        barrier.wait()
+        for _ in range(requests):
+            connection.request("GET", "/asset.png")
+            connection.getresponse().read()
+        return requests
+    finally:
+        connection.close()
+
+
+def start_threaded(directory: str, env: str, port: int, args: argparse.Namespace):
+    handler = handler_from(directory, False, env)
+    handler.log_message = lambda *_: None
+    server = ThreadedHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return lambda: (server.shutdown(), server.server_close())
+
+
+def start_async(directory: str, env: str, port: int, args: argparse.Namespace):
+    server = AsyncServer(directory, env, False, max_connections=args.clients, workers=args.workers)
+    server.log_message = lambda *_: None
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve(port, "127.0.0.1"))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    time.sleep(0.2)
+
+    def stop():
+        loop.call_soon_threadsafe(task.cancel)
+        while not task.done():
+            time.sleep(0.01)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return stop
+
+
+def run(start, directory: str, env: str, args: argparse.Namespace) -> tuple[float, int]:
+    port = free_port()
+    before = threading.active_count()
+    stop = start(directory, env, port, args)
+    barrier = threading.Barrier(args.clients + 1)
+    peak = [0]
+    done = threading.Event()
+
+    def sample():
+        # client and sampler threads are not counted
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], threading.active_count() - before - args.clients - 1)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            futures = [executor.submit(client, port, args.requests, barrier) for _ in range(args.clients)]
+            barrier.wait()
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            start_time = time.perf_counter()
+            served = sum(future.result() for future in futures)
+            elapsed = time.perf_counter() - start_time
+            done.set()
+            sampler.join()
+    finally:
+        stop()
+    return served / elapsed, peak[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--size", type=int, default=64, help="asset size in KiB")
+    parser.add_argument("--workers", type=int, default=4, help="asyncio server executor threads")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = os.path.join(directory, ".env")
+        open(env, "w").close()
+        with open(os.path.join(directory, "asset.png"), "wb") as f:
+            f.write(os.urandom(args.size * 1024))
+
+        print(f"{'server':>9} {'requests/s':>11} {'peak server threads':>20}")
+        for name, start in (("threaded", start_threaded), ("async", start_async)):
+            rate, threads = run(start, directory, env, args)
+            print(f"{name:>9} {rate:>11.0f} {threads:>20}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Serial vs pipelined OVEHandler.tee for cells with 1, 10 and 100 outputs.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_tee_pipeline.py --latency 0.02
+"""
+import os
+import time
+import base64
+import argparse
+import tempfile
+
+from argparse import Namespace
+
+from ove_jupyter_utils.ove_handler import OVEHandler
+from ove_jupyter_utils.stub_server import StubServer
+
+
+def make_outputs(n: int, size: int) -> list[list]:
+    return [[str(i), "png", base64.b64encode(os.urandom(size)).decode("utf-8"), None] for i in range(n)]
+
+
+def make_handler(stub: StubServer, out: str, pipeline: bool, workers: int) -> OVEHandler:
+    env = os.path.join(out, ".env")
+    with open(env, "w") as f:
+        f.write(f"OVE_CORE={stub.url}\nOVE_HOST=http://127.0.0.1:8000\nOVE_USERNAME=user\nOVE_PASSWORD=pass\n")
+    handler = OVEHandler()
+    handler.load_config(Namespace(observatory="do", env=env, out=os.path.join(out, ".ove"), mode="production",
+                                  remove=True, multi_controller=False, pipeline=pipeline, workers=workers))
+    return handler
+
+
+def cell_config(cell_no: int) -> Namespace:
+    return Namespace(cell_no=cell_no, row=None, col=None, width=None, height=None, x=None, y=None, from_=None,
+                     to_=None, split="width")
+
+
+def run(n: int, pipeline: bool, args: argparse.Namespace) -> float:
+    with tempfile.TemporaryDirectory() as out, StubServer(latency=args.latency) as stub:
+        handler = make_handler(stub, out, pipeline, args.workers)
+        outputs = make_outputs(n, args.size)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            handler.tee(cell_config(1), outputs)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.02, help="stub round-trip latency in seconds")
+    parser.add_argument("--size", type=int, default=256 * 1024, help="decoded bytes per PNG output")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'outputs':>8} {'serial (s)':>12} {'pipelined (s)':>14} {'speedup':>8}")
+    for n in (1, 10, 100):
+        serial, pipelined = run(n, False, args), run(n, True, args)
+        print(f"{n:>8} {serial:>12.3f} {pipelined:>14.3f} {serial / pipelined:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
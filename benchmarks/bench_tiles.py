@@ -0,0 +1,62 @@
+"""Time to build a Deep Zoom tile pyramid with one tiling thread against every core, next to writing the image as a
+single PNG. Pillow releases the GIL while cropping and encoding, so the tile pool scales across cores.
+
+Run from the repository root with the utils package and Pillow installed:
+    python benchmarks/bench_tiles.py --size 8192
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from PIL import Image
+
+from ove_jupyter_utils.tile_pyramid import TilePyramid
+
+
+def make_image(size: int, filename: str) -> None:
+    # a gradient with noise, compressible like a plot but not trivially so
+    gradient = Image.linear_gradient("L").resize((size, size))
+    noise = Image.effect_noise((size, size), 32)
+    Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.ROTATE_90))).save(filename, "PNG",
+                                                                                              compress_level=1)
+
+
+def count_files(dir_: str) -> tuple[int, int]:
+    files = [os.path.join(root, f) for root, _, fs in os.walk(dir_) for f in fs]
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=8192, help="width and height of the image in pixels")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out:
+        source = f"{out}/source.png"
+        make_image(args.size, source)
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            with Image.open(source) as image:
+                image.save(f"{out}/single.png", "PNG", compress_level=6)
+            timings.append(time.perf_counter() - start)
+        print(f"{'version':>10} {'time (s)':>9} {'files':>7} {'MiB':>7}")
+        print(f"{'single':>10} {min(timings):>9.2f} {1:>7} {os.path.getsize(f'{out}/single.png') / 2 ** 20:>7.1f}")
+
+        for name, workers in (("serial", 1), ("parallel", os.cpu_count() or 1)):
+            timings = []
+            for run in range(args.repeat):
+                dir_ = f"{out}/{name}-{run}"
+                os.makedirs(dir_)
+                start = time.perf_counter()
+                TilePyramid(workers=workers).write(source, dir_, "pyramid")
+                timings.append(time.perf_counter() - start)
+            files, size = count_files(dir_)
+            print(f"{name:>10} {min(timings):>9.2f} {files:>7} {size / 2 ** 20:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
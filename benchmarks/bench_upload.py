@@ -0,0 +1,90 @@
+"""Server side latency and peak memory of a tee sent as one base64 JSON document vs multipart with binary parts.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/bench_upload.py --outputs 4 --size 8388608
+"""
+import os
+import json
+import time
+import uuid
+import base64
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+import requests
+
+from ove_jupyter_utils.file_server import ThreadedHTTPServer
+from ove_jupyter_utils.server import handler_from
+from ove_jupyter_utils.stub_server import StubServer
+
+CONFIG = {"observatory": "do", "env": None, "out": None, "mode": "production", "remove": True,
+          "multi_controller": False}
+CELL = {"cell_no": 1, "row": None, "col": None, "width": None, "height": None, "x": None, "y": None, "from": None,
+        "to": None, "split": "width"}
+
+
+def json_body(images: list[bytes]) -> tuple[bytes, str]:
+    outputs = [[str(i), "png", base64.b64encode(image).decode("ascii"), None] for i, image in enumerate(images)]
+    return json.dumps({"config": CELL, "outputs": outputs}).encode("utf-8"), "application/json"
+
+
+def multipart_body(images: list[bytes]) -> tuple[bytes, str]:
+    # what the browser's FormData produces from main.js
+    boundary = uuid.uuid4().hex
+    outputs = [[str(i), "png", {"part": f"output-{i}"}, None] for i in range(len(images))]
+    parts = [f"--{boundary}\r\nContent-Disposition: form-data; name=\"tee\"\r\n\r\n".encode("ascii"),
+             json.dumps({"config": CELL, "outputs": outputs}).encode("utf-8"), b"\r\n"]
+    for i, image in enumerate(images):
+        parts += [f"--{boundary}\r\nContent-Disposition: form-data; name=\"output-{i}\"; filename=\"output-{i}.png\""
+                  f"\r\nContent-Type: image/png\r\n\r\n".encode("ascii"), image, b"\r\n"]
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def run(make_body, args: argparse.Namespace) -> tuple[float, int]:
+    with tempfile.TemporaryDirectory() as out, StubServer() as stub:
+        env, server_env = os.path.join(out, ".env"), os.path.join(out, ".server.env")
+        with open(env, "w") as f:
+            f.write(f"OVE_CORE={stub.url}\nOVE_HOST=http://127.0.0.1:8000\nOVE_USERNAME=user\nOVE_PASSWORD=pass\n")
+        # no credentials, so the server itself doesn't ask for Basic auth
+        open(server_env, "w").close()
+        handler = handler_from(out, False, server_env)
+        handler.log_message = lambda *_: None
+        server = ThreadedHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            requests.post(f"{url}/config", json={**CONFIG, "env": env, "out": out}).raise_for_status()
+            timings, peaks = [], []
+            for _ in range(args.repeat):
+                # new bytes every run so no output is skipped as unchanged
+                body, content_type = make_body([os.urandom(args.size) for _ in range(args.outputs)])
+                tracemalloc.start()
+                start = time.perf_counter()
+                requests.post(f"{url}/tee", data=body, headers={"Content-Type": content_type}).raise_for_status()
+                timings.append(time.perf_counter() - start)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            return min(timings), min(peaks)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outputs", type=int, default=4)
+    parser.add_argument("--size", type=int, default=8 * 1024 * 1024, help="bytes per PNG output")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'format':>10} {'latency (s)':>12} {'peak (MiB)':>11}")
+    for name, make_body in (("json", json_body), ("multipart", multipart_body)):
+        latency, peak = run(make_body, args)
+        print(f"{name:>10} {latency:>12.3f} {peak / 2 ** 20:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
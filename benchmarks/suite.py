@@ -0,0 +1,289 @@
+"""Benchmark suite for the layout, formatting, asset and serving hot paths.
+
+Every case runs offline (OVE is replaced by the bundled stub server) and reports seconds per call. Results are written as
+JSON and can be compared against a stored baseline, a case slower than the baseline by more than the threshold is a
+regression and makes the run exit with status 1.
+
+Run from the repository root with the utils package installed:
+    python benchmarks/suite.py --output results.json --baseline benchmarks/baseline.json
+    python benchmarks/suite.py --filter geometry --save-baseline benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import base64
+import timeit
+import typing
+import argparse
+import importlib.util
+import platform
+import tempfile
+import itertools
+import statistics
+import threading
+import contextlib
+
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+from ove_jupyter_utils.geometry import Geometry
+from ove_jupyter_utils.data_type import DataType
+from ove_jupyter_utils.file_handler import FileHandler
+from ove_jupyter_utils.asset_handler import AssetHandler
+from ove_jupyter_utils.output_formatter import OutputFormatter
+from ove_jupyter_utils.layout_validator import LayoutValidator, DisplayType
+from ove_jupyter_utils.stub_server import StubServer
+from ove_jupyter_utils.file_server import ThreadedHTTPServer, handler_from
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_file_server import fetch  # noqa: E402
+from bench_tee_pipeline import make_handler, make_outputs, cell_config  # noqa: E402
+
+CANVAS = {"w": 7680, "h": 2160}
+BOUNDS = {"columns": 4, "rows": 2}
+
+# name -> setup, setup is a context manager yielding the function to time
+CASES = {}
+
+
+class MissingDependency(Exception):
+    pass
+
+
+def requires(module: str) -> None:
+    # a case that needs an optional dependency is skipped without it, any other error fails the run
+    if importlib.util.find_spec(module) is None:
+        raise MissingDependency(f"{module} is not installed")
+
+
+def case(name: str):
+    def register(setup: typing.Callable) -> typing.Callable:
+        CASES[name] = contextlib.contextmanager(setup)
+        return setup
+
+    return register
+
+
+def layout_args(mode: DisplayType) -> Namespace:
+    args = Namespace(cell_no=1, row=None, col=None, width=None, height=None, x=None, y=None, from_=None, to_=None,
+                     split="width")
+    if mode == DisplayType.GRID:
+        args.row, args.col = [1], [2]
+    elif mode == DisplayType.PIXEL:
+        args.x, args.y, args.width, args.height = [0.0], [0.0], [0.5], [0.5]
+    elif mode == DisplayType.FLEX:
+        args.from_, args.to_ = [1, 1], [3, 2]
+    return args
+
+
+for display_type in DisplayType:
+    def setup_geometry(mode=display_type):
+        args = layout_args(mode)
+        yield lambda: Geometry(args, mode, CANVAS, BOUNDS, 10000)
+
+    case(f"geometry/{display_type.name.lower()}/10000")(setup_geometry)
+
+    def setup_validate(mode=display_type):
+        validator, args = LayoutValidator(), layout_args(mode)
+        assert validator.validate(args) == mode
+        yield lambda: validator.validate(args)
+
+    case(f"validate/{display_type.name.lower()}")(setup_validate)
+
+
+def dataframe_html(rows: int) -> str:
+    # what pandas.DataFrame._repr_html_ produces
+    body = "".join(f"<tr><th>{i}</th><td>{i * 0.5}</td><td>name {i}</td><td>{i % 7}</td></tr>" for i in range(rows))
+    return ("<div><style scoped>\n.dataframe tbody tr th:only-of-type {\n vertical-align: middle;\n}\n</style>\n"
+            "<table border=\"1\" class=\"dataframe\"><thead><tr style=\"text-align: right;\"><th></th><th>a</th>"
+            f"<th>b</th><th>c</th></tr></thead><tbody>{body}</tbody></table></div>")
+
+
+def geojson_features(n: int) -> dict:
+    return {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"name": f"feature {i}"},
+         "geometry": {"type": "Polygon", "coordinates": [[[i, 0], [i + 1, 0], [i + 1, 1], [i, 0]]]}} for i in range(n)]}
+
+
+FORMAT_CASES = {
+    DataType.HTML: lambda: "<div>" + "<p>paragraph of text</p>" * 2000 + "</div>",
+    DataType.DATATABLE: lambda: dataframe_html(1000),
+    DataType.JSON: lambda: {"values": list(range(5000)), "nested": {"a": [{"b": i} for i in range(500)]}},
+    DataType.GEOJSON: lambda: geojson_features(1000),
+    DataType.MARKDOWN: lambda: "# Title\n\n" + "Some *markdown* with a [link](http://example.com).\n\n" * 200,
+    DataType.LATEX: lambda: "$$\\sum_{i=0}^{n} x_i^2$$",
+    DataType.SVG: lambda: "<svg xmlns=\"http://www.w3.org/2000/svg\">" + "<circle r=\"1\"/>" * 5000 + "</svg>",
+    DataType.PNG: lambda: base64.b64encode(os.urandom(1024 * 1024)).decode("ascii")
+}
+GEOJSON_METADATA = {"layer_options": {"basemap_id": "light"}, "url_template": "https://tiles/{basemap_id}/{z}/{x}/{y}"}
+
+for data_type, make_data in FORMAT_CASES.items():
+    def setup_format(data_type=data_type, make_data=make_data):
+        with tempfile.TemporaryDirectory() as out:
+            file_handler = FileHandler()
+            formatter = OutputFormatter(file_handler, AssetHandler(out, "http://localhost", file_handler))
+            data = make_data()
+            metadata = GEOJSON_METADATA if data_type == DataType.GEOJSON else None
+            if data_type == DataType.LATEX:
+                # IPython renders LaTeX to PNG with matplotlib, without it latex_to_html fails
+                requires("matplotlib")
+            if data_type in (DataType.MARKDOWN, DataType.LATEX):
+                # a new input every call so the render caches never answer
+                counter = itertools.count()
+                formatter.format_data(data, data_type, metadata)
+                yield lambda: formatter.format_data(f"{data} {next(counter)}", data_type, metadata)
+            else:
+                yield lambda: formatter.format_data(data, data_type, metadata)
+
+    case(f"format/{data_type.name.lower()}")(setup_format)
+
+
+for name, size in (("small", 64 * 1024), ("huge", 32 * 1024 * 1024)):
+    def setup_write_asset(size=size):
+        data = base64.b64encode(os.urandom(size)).decode("ascii")
+        with tempfile.TemporaryDirectory() as out:
+            asset_handler = AssetHandler(out, "http://localhost", FileHandler())
+            yield lambda: asset_handler.write_asset(data, 1, 0, DataType.PNG)
+
+    case(f"write_asset/png/{name}")(setup_write_asset)
+
+
+for pipeline in (False, True):
+    def setup_tee(pipeline=pipeline):
+        with tempfile.TemporaryDirectory() as out, StubServer() as stub:
+            handler = make_handler(stub, out, pipeline, 4)
+            # alternated so no output is skipped as unchanged
+            outputs = itertools.cycle([make_outputs(10, 64 * 1024), make_outputs(10, 64 * 1024)])
+            yield lambda: handler.tee(cell_config(1), next(outputs))
+
+    case(f"tee/{'pipelined' if pipeline else 'serial'}/10")(setup_tee)
+
+
+@case("live/collapse/1000")
+def setup_collapse():
+    requires("IPython")
+    from ove_jupyter.live_tee import collapse_updates
+
+    def frame(i: int, update: bool) -> dict:
+        return {"data": {"text/plain": str(i)}, "metadata": {}, "transient": {"display_id": "plot"}, "update": update}
+
+    # display then update_display comes back as one display holding the latest frame, not as an update
+    assert collapse_updates([frame(0, False), frame(1, True)]) == [frame(1, False)]
+    outputs = [frame(0, False)] + [frame(i, True) for i in range(1, 1000)]
+    yield lambda: collapse_updates(outputs)
+
+
+@case("file_server/range/8-clients")
+def setup_file_server():
+    size, chunk = 16 * 2 ** 20, 2 ** 20
+    with tempfile.TemporaryDirectory() as directory:
+        env = os.path.join(directory, ".env")
+        open(env, "w").close()
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(size))
+        handler = handler_from(directory, False, env)
+        handler.log_message = lambda *_: None
+        server = ThreadedHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                yield lambda: sum(executor.map(lambda _: fetch(port, "/video.mp4", size, chunk, True), range(8)))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def measure(fn: typing.Callable, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(fn)
+    # enough calls per run for the run to take min_time
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median_s": statistics.median(runs), "min_s": min(runs), "runs": repeat, "number": number}
+
+
+def run(names: list[str], repeat: int, min_time: float) -> dict:
+    results = {}
+    for name in names:
+        try:
+            with CASES[name]() as fn:
+                fn()
+                results[name] = measure(fn, repeat, min_time)
+        except (ImportError, MissingDependency) as e:
+            results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        if "skipped" in results[name]:
+            print(f"{name:<32} skipped ({results[name]['skipped']})")
+        elif "error" in results[name]:
+            print(f"{name:<32} failed ({results[name]['error']})")
+        else:
+            print(f"{name:<32} {results[name]['median_s'] * 1e3:>12.4f} ms")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, metric: str) -> list[str]:
+    regressions = []
+    print(f"\n{'case':<32} {'baseline (ms)':>14} {'now (ms)':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline["results"].get(name, {})
+        if metric not in result or metric not in before:
+            continue
+        change = result[metric] / before[metric] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<32} {before[metric] * 1e3:>14.4f} {result[metric] * 1e3:>12.4f} {change:>+8.0%}{flag}")
+    if baseline.get("machine") != get_machine():
+        print("\nThe baseline was recorded on a different machine, timings may not be comparable")
+    return regressions
+
+
+def get_machine() -> dict:
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "system": platform.system(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", type=str, nargs="*", default=None, help="only run cases containing these")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per run")
+    parser.add_argument("--output", type=str, default=None, help="write results as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="compare against results written before")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown counted as a regression")
+    parser.add_argument("--metric", type=str, default="min_s", choices=["min_s", "median_s"],
+                        help="compared timing, the fastest run is the least noisy")
+    parser.add_argument("--save-baseline", type=str, default=None, help="write results as the new baseline")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.filter is None or any(f in name for f in args.filter)]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    results = {"machine": get_machine(), "time": time.time(), "results": run(names, args.repeat, args.min_time)}
+    for filename in (args.output, args.save_baseline):
+        if filename is not None:
+            with open(filename, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    failed = [name for name, result in results["results"].items() if "error" in result]
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results["results"], json.load(f), args.threshold, args.metric)
+        if len(regressions) > 0:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+    if len(failed) > 0:
+        print(f"\n{len(failed)} failed: {', '.join(failed)}")
+    if len(regressions) > 0 or len(failed) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,8 +42,9 @@ class IPythonDisplayType(Enum):
         return cls(search.group(1))
 
     def format_ipython_output(self, output: dict) -> dict:
+        # a shallow copy, the captured output is displayed again after the tee
         if self == IPythonDisplayType.YOUTUBE:
-            output["data"] = {k: v for k, v in output["data"].items() if "image" not in k}
+            return {**output, "data": {k: v for k, v in output["data"].items() if "image" not in k}}
 
         return output
 
@@ -0,0 +1,99 @@
+import time
+import typing
+import threading
+
+from ove_jupyter_utils.tee_stats import TEE_STATS
+
+
+def add_output(outputs: list[dict], positions: dict, output: dict) -> None:
+    """Same as the notebook, update_display replaces the output with its display_id instead of adding one."""
+    display_id = (output.get("transient", None) or {}).get("display_id", None)
+    if display_id is not None and display_id in positions and output.get("update", False):
+        # kept as the display it replaces, republishing an update would target a display missing from the cell
+        outputs[positions[display_id]] = {**output, "update": False}
+        return
+    if display_id is not None and display_id not in positions:
+        positions[display_id] = len(outputs)
+    outputs.append(output)
+
+
+def collapse_updates(outputs: list[dict]) -> list[dict]:
+    collapsed, positions = [], {}
+    for output in outputs:
+        add_output(collapsed, positions, output)
+    return collapsed
+
+
+class LiveTee:
+    """Sends display updates to OVE while a cell runs, at most fps times a second.
+
+    Only the latest output at each position is kept. Frames published while a tee is in flight replace each other,
+    so a slow wall drops intermediate frames instead of queueing them.
+    """
+
+    def __init__(self, tee: typing.Callable[[list[dict]], typing.Any], fps: float):
+        self.tee = tee
+        self.interval = 1 / fps if fps > 0 else 0
+        self.outputs = []
+        self.positions = {}
+        self.cleared = False
+        self.dirty = False
+        self.closed = False
+        self.frames = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def hook(self, publisher: typing.Any) -> None:
+        """Wraps the capturing display publisher, which is discarded with its wrappers once the capture ends."""
+        publish, clear_output = publisher.publish, publisher.clear_output
+
+        def live_publish(data, metadata=None, source=None, *, transient=None, update=False):
+            publish(data, metadata, source, transient=transient, update=update)
+            self.publish({"data": data, "metadata": metadata, "transient": transient, "update": update})
+
+        def live_clear_output(wait=False):
+            clear_output(wait)
+            with self.condition:
+                self.cleared = True
+
+        publisher.publish = live_publish
+        publisher.clear_output = live_clear_output
+        self.thread.start()
+
+    def publish(self, output: dict) -> None:
+        with self.condition:
+            if self.cleared:
+                # clear_output(wait=True) then display is how loops redraw, the new output takes the old place
+                self.outputs, self.positions, self.cleared = [], {}, False
+            add_output(self.outputs, self.positions, output)
+            if self.dirty:
+                self.dropped += 1
+            self.dirty = True
+            self.condition.notify()
+
+    def _run(self) -> None:
+        next_frame = 0.0
+        while True:
+            with self.condition:
+                while not self.closed and (not self.dirty or time.monotonic() < next_frame):
+                    self.condition.wait(None if not self.dirty else next_frame - time.monotonic())
+                if self.closed:
+                    return
+                outputs, self.dirty = list(self.outputs), False
+            next_frame = time.monotonic() + self.interval
+            try:
+                self.tee(outputs)
+                self.frames += 1
+            except Exception as e:
+                print(f"Live updates stopped: {e}")
+                return
+
+    def close(self) -> None:
+        """Stops after the tee in flight, the final outputs are sent by the caller."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        TEE_STATS.add_counts(live_frames=self.frames, live_dropped=self.dropped)
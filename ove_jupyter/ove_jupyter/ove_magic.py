@@ -1,4 +1,3 @@
-import copy
 import json
 import time
 import uuid
@@ -17,8 +16,10 @@ from ove_jupyter_utils.utils import load_base_config, OVEException, xorExist, ge
 from ove_jupyter_utils.locks import LATEX_LOCK, MARKDOWN_LOCK
 from ove_jupyter_utils.server import create_server
 from ove_jupyter_utils.file_handler import FileHandler
+from ove_jupyter_utils.tee_stats import TEE_STATS
 from ove_jupyter_utils.ove_handler import OVEHandler
 from .ipython_display_type import IPythonDisplayType, to_data_type
+from .live_tee import LiveTee, collapse_updates
 
 
 @magics_class
@@ -28,9 +29,18 @@ class OVEMagic(Magics):
         self.ove_handler = OVEHandler()
         self.host = None
 
-    def get_output(self, cell: typing.Any) -> CapturedIO:
+    def get_output(self, cell: typing.Any, live: typing.Optional[LiveTee] = None) -> CapturedIO:
         with capture_output(True, True, True) as io:
-            get_ipython().run_cell(cell)
+            if live is not None:
+                live.hook(get_ipython().display_pub)
+            try:
+                get_ipython().run_cell(cell)
+            finally:
+                if live is not None:
+                    live.close()
+        if live is not None:
+            # every update_display is captured as a new output, only the latest of each was sent live
+            io._outputs[:] = collapse_updates(io._outputs)
         return io
 
     def get_injected(self, content: typing.Any) -> dict:
@@ -49,26 +59,29 @@ class OVEMagic(Magics):
             return None
 
     def format_ipython(self, io: CapturedIO):
+        return self.format_outputs(io._outputs)
+
+    def format_outputs(self, outputs: list[dict]):
         formatted_outputs = []
         injected = {}
 
-        for output_idx, output_ in enumerate(io._outputs):
-            output = copy.deepcopy(output_)
+        # the captured outputs are redisplayed afterwards, so they are only read, the filtered dicts share their values
+        for output_idx, output in enumerate(outputs):
             if len(output["data"]) == 0:
                 continue
 
-            injected[output_idx] = [io._outputs[output_idx]]
+            injected[output_idx] = [output]
 
-            display_mode = IPythonDisplayType.from_ipython_output(io._outputs[output_idx])
+            display_mode = IPythonDisplayType.from_ipython_output(output)
             if display_mode is not None:
                 output = display_mode.format_ipython_output(output)
 
-            output["data"] = {k: v for k, v in output["data"].items() if "text/plain" not in k}
+            output_data = {k: v for k, v in output["data"].items() if "text/plain" not in k}
 
-            if len(output["data"]) > 1:
-                raise OVEException(f"Unexpected output size: {len(output['data'])}")
+            if len(output_data) > 1:
+                raise OVEException(f"Unexpected output size: {len(output_data)}")
 
-            for output_type, data in output["data"].items():
+            for output_type, data in output_data.items():
                 data_type = to_data_type(display_mode, output_type, data)
                 metadata = output["metadata"].get(output_type, None)
                 formatted_outputs.append((str(output_idx), data_type.value, data, metadata))
@@ -86,6 +99,8 @@ class OVEMagic(Magics):
     @magic_arguments.argument("--from", "-f", type=int, default=None, nargs="*", dest="from_")
     @magic_arguments.argument("--to", "-t", type=int, default=None, nargs="*", dest="to_")
     @magic_arguments.argument("--split", "-s", type=str, default="width", nargs="?")
+    @magic_arguments.argument("--live", "-lv", type=bool, default=False, nargs="?")
+    @magic_arguments.argument("--fps", type=float, default=2.0, nargs="?")
     @cell_magic
     def tee(self, line, cell):
         def optional_float(x):
@@ -99,24 +114,61 @@ class OVEMagic(Magics):
             return [opt(y) for y in x]
         args = magic_arguments.parse_argstring(self.tee, line)
         args.x, args.y, args.width, args.height = optional_float(args.x), optional_float(args.y), optional_float(args.width), optional_float(args.height)
+        # not part of the layout, so they are kept out of the section fingerprints
+        live, fps = args.live, args.fps
+        del args.live, args.fps
+
+        with TEE_STATS.tee(args.cell_no):
+            live_tee = None
+            if live:
+                live_tee = LiveTee(lambda outputs: self.ove_handler.tee(args, self.format_outputs(outputs)[0]), fps)
+            with TEE_STATS.stage("capture"):
+                io = self.get_output(cell, live_tee)
+            with TEE_STATS.stage("format_ipython"):
+                formatted_outputs, injected = self.format_ipython(io)
+            controller_urls = self.ove_handler.tee(args, formatted_outputs)
+
+            with TEE_STATS.stage("display"):
+                for data in controller_urls:
+                    idx = int(data["idx"])
+                    if injected.get(idx, None) is not None:
+                        injected[idx].append(self.inject(controller_injection=data["url"]))
+                    else:
+                        injected[idx] = self.inject(controller_injection=data["url"])
+
+                injected_outputs = []
+                for _, v in sorted(injected.items()):
+                    injected_outputs.extend([x for x in v if x is not None])
+
+                io._outputs = injected_outputs
+                io()
 
-        io = self.get_output(cell)
-        formatted_outputs, injected = self.format_ipython(io)
-        controller_urls = self.ove_handler.tee(args, formatted_outputs)
-
-        for data in controller_urls:
-            idx = int(data["idx"])
-            if injected.get(idx, None) is not None:
-                injected[idx].append(self.inject(controller_injection=data["url"]))
-            else:
-                injected[idx] = self.inject(controller_injection=data["url"])
-
-        injected_outputs = []
-        for _, v in sorted(injected.items()):
-            injected_outputs.extend([x for x in v if x is not None])
-
-        io._outputs = injected_outputs
-        io()
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument("--last", "-l", type=int, default=1, nargs="?")
+    @magic_arguments.argument("--trace", "-t", type=str, default=None, nargs="?")
+    @magic_arguments.argument("--clear", "-c", type=bool, default=False, nargs="?")
+    @line_magic
+    def ove_stats(self, line):
+        args = magic_arguments.parse_argstring(self.ove_stats, line)
+        stats = TEE_STATS.get_stats(args.last)
+        for tee in stats["tees"]:
+            print(f"Cell {tee['cell_no']}: {tee['total_ms']:.1f}ms, {tee['bytes_written']} bytes written, "
+                  f"{sum(tee['requests'].values())} requests")
+            for name, stage in sorted(tee["stages"].items(), key=lambda x: -x[1]["ms"]):
+                print(f"    {name:<16} {stage['ms']:>10.1f}ms {stage['calls']:>6} calls")
+            for endpoint, count in sorted(tee["requests"].items()):
+                print(f"    {endpoint:<16} {count:>12} requests")
+            if "connections" in tee:
+                print(f"    {'connections':<16} {tee['connections']['connections']:>12} opened, "
+                      f"{tee['connections']['reused']} requests reused one")
+            for name, cache in sorted(tee.get("render_cache", {}).items()):
+                print(f"    {name + ' cache':<16} {cache['hits']:>6} hits {cache['disk_hits']:>6} disk hits "
+                      f"{cache['misses']:>6} misses")
+        if args.trace is not None:
+            TEE_STATS.export_trace(args.trace, args.last)
+            print(f"Trace written to {args.trace}")
+        if args.clear:
+            TEE_STATS.clear()
 
     @magic_arguments.magic_arguments()
     @magic_arguments.argument("--observatory", "-os", type=str, default="do", nargs="?")
@@ -125,6 +177,12 @@ class OVEMagic(Magics):
     @magic_arguments.argument("--mode", "-m", type=str, default="production", nargs="?")
     @magic_arguments.argument("--remove", "-rm", type=bool, default=True, nargs="?")
     @magic_arguments.argument("--multi_controller", "-mc", type=bool, default=False, nargs="?")
+    @magic_arguments.argument("--pipeline", "-pl", type=bool, default=False, nargs="?")
+    @magic_arguments.argument("--workers", "-wk", type=int, default=4, nargs="?")
+    @magic_arguments.argument("--content_addressed", "-ca", type=bool, default=False, nargs="?")
+    @magic_arguments.argument("--downscale", "-ds", type=bool, default=False, nargs="?")
+    @magic_arguments.argument("--background", "-bg", type=bool, default=False, nargs="?")
+    @magic_arguments.argument("--tiles", "-tl", type=bool, default=False, nargs="?")
     @line_magic
     def ove_config(self, line):
         args = magic_arguments.parse_argstring(self.ove_config, line)
@@ -2,18 +2,22 @@ import os
 import json
 import pathlib
 import tornado
+import typing
 import argparse
 
 from traceback import format_exc
 
-from .handlers import OVEJupyterHandler, ConfigHandler, TeeHandler, StaticHandler, ModeHandler
+from .handlers import OVEJupyterHandler, ConfigHandler, TeeHandler, StaticHandler, ModeHandler, StatsHandler
+from .ordered_executor import OrderedExecutor
 from jupyter_server.extension.application import ExtensionApp
 from traitlets import Int
 
-from ove_jupyter_utils.utils import load_base_config
+from ove_jupyter_utils.utils import load_base_config, OVEException
 
 from dotenv import dotenv_values
 from ove_jupyter_utils.ove_handler import OVEHandler
+from ove_jupyter_utils.tee_stats import TEE_STATS
+from ove_jupyter_utils.multipart import UPLOAD_DIR
 
 class OVEJupyterApp(ExtensionApp):
     name = "ove-jupyter"
@@ -23,36 +27,104 @@ class OVEJupyterApp(ExtensionApp):
 
     static_paths = [os.path.join(pathlib.Path.cwd(), ".ove")]
 
+    max_concurrency = Int(4, config=True, help="Config and tee requests handled at once across all notebooks")
+    max_queued = Int(32, config=True, help="Requests waiting for a worker before new ones are answered with 503")
+    max_notebooks = Int(64, config=True, help="Notebooks remembered before the least recently used is forgotten")
+
     ove_config = {}
-    ove_handler = OVEHandler()
+    # space -> handler. Notebooks writing to the same output directory or OVE space share one handler, a config from
+    # any of them clears the wall and directory for all, so they can't keep separate section state
+    ove_handlers = {}
+    # space -> output directory
+    ove_outs = {}
+    # notebook path -> space, least recently used first
+    notebooks = {}
+    last_space = None
+    executor = None
+
+    def get_space(self, notebook: str, data: typing.Optional[dict] = None) -> typing.Optional[str]:
+        # a notebook that was never configured tees into the last configured space
+        space = self.notebooks.pop(notebook, None)
+        if space is None:
+            return self.last_space
+        self.notebooks[notebook] = space
+        return space
+
+    def add_notebook(self, notebook: str, config: dict) -> str:
+        # added before the config is queued so tees sent meanwhile are ordered after it
+        out = os.path.join(pathlib.Path.cwd(), config["out"])
+        space = next((k for k, v in self.ove_outs.items() if v == out), config["observatory"])
+        self.ove_outs[space] = out
+        self.ove_handlers.setdefault(space, OVEHandler())
+        self.notebooks.pop(notebook, None)
+        self.notebooks[notebook] = space
+        self._evict()
+        return space
+
+    def _evict(self) -> None:
+        while len(self.notebooks) > self.max_notebooks:
+            self.notebooks.pop(next(iter(self.notebooks)))
+        # handlers hold a session and a startup thread, they are closed once no notebook uses them
+        used = set(self.notebooks.values())
+        for space in [k for k in self.ove_handlers if k not in used and self.executor.is_idle(k)]:
+            self.ove_handlers.pop(space).close()
+            self.ove_outs.pop(space)
+
+    def get_upload_dir(self, space: typing.Optional[str]) -> str:
+        # before the first config the default output directory is used
+        return os.path.join(self.ove_outs.get(space, self.static_paths[0]), UPLOAD_DIR)
+
+    async def stop_extension(self):
+        # queued tees are dropped, the running ones finish on their threads
+        if self.executor is not None:
+            self.executor.shutdown()
+        for handler in self.ove_handlers.values():
+            handler.close()
+        self.ove_handlers.clear()
+        self.ove_outs.clear()
+        self.notebooks.clear()
 
     def initialize_handlers(self):
-        def config_handler(config: dict):
+        executor = self.executor = OrderedExecutor(self.max_concurrency, self.max_queued)
+
+        def config_handler(space: str, config: dict):
             config["out"] = os.path.join(pathlib.Path.cwd(), config["out"])
-            self.static_paths.append(config["out"])
+            if config["out"] not in self.static_paths:
+                self.static_paths.append(config["out"])
             config["env"] = os.path.join(pathlib.Path.cwd(), config["env"])
 
-            self.ove_handler.load_config(argparse.Namespace(**config))
+            self.ove_handlers[space].load_config(argparse.Namespace(**config))
+            self.last_space = space
 
-        def tee_handler(data: dict):
+        def tee_handler(space: typing.Optional[str], data: dict):
             try:
                 config = data["config"]
                 config["from_"] = config["from"]
                 config["to_"] = config["to"]
                 config.pop("from")
                 config.pop("to")
-                return json.dumps(self.ove_handler.tee(argparse.Namespace(**data["config"]), data["outputs"]))
+                if space not in self.ove_handlers:
+                    raise OVEException("No OVE configuration, run the config first")
+                outputs = self.ove_handlers[space].tee(argparse.Namespace(**data["config"]), data["outputs"])
+                return json.dumps(outputs)
             except Exception as e:
                 return json.dumps({"error": str(e), "trace": format_exc()})
 
-        def mode_handler():
-            return self.ove_handler.config["mode"]
+        def mode_handler(notebook: str):
+            return self.ove_handlers[self.get_space(notebook)].config["mode"]
+
+        def stats_handler(trace: bool):
+            return json.dumps(TEE_STATS.get_trace() if trace else TEE_STATS.get_stats())
 
         self.handlers.extend([
             (f"{self.default_url}/hello", OVEJupyterHandler),
-            (f"{self.default_url}/config", ConfigHandler, {"handler": config_handler}),
-            (f"{self.default_url}/tee", TeeHandler, {"handler": tee_handler}),
+            (f"{self.default_url}/config", ConfigHandler,
+             {"handler": config_handler, "executor": executor, "key": self.add_notebook}),
+            (f"{self.default_url}/tee", TeeHandler,
+             {"handler": tee_handler, "executor": executor, "key": self.get_space,
+              "upload_dir": self.get_upload_dir}),
             (f"{self.default_url}/static/(.*)", StaticHandler, {"path": ".ove"}),
-            (f"{self.default_url}/mode", ModeHandler, {"handler": mode_handler})
+            (f"{self.default_url}/mode", ModeHandler, {"handler": mode_handler}),
+            (f"{self.default_url}/stats(/trace)?", StatsHandler, {"handler": stats_handler})
         ])
         print("Loaded OVE Jupyter Server Extension")
\ No newline at end of file
@@ -1,3 +1,5 @@
+import json
+import inspect
 import pathlib
 
 import tornado
@@ -7,6 +9,10 @@ from jupyter_server.extension.handler import ExtensionHandlerMixin
 from jupyter_server.files.handlers import FilesHandler
 
 from ove_jupyter_utils import custom_hello_world
+from ove_jupyter_utils.asset_store import is_immutable
+from ove_jupyter_utils.multipart import MultipartParser, get_boundary
+
+from .ordered_executor import QueueFull
 
 
 class OVEJupyterHandler(ExtensionHandlerMixin, JupyterHandler):
@@ -20,27 +26,96 @@ class OVEJupyterHandler(ExtensionHandlerMixin, JupyterHandler):
         self.finish(custom_hello_world())
 
 
-class ConfigHandler(ExtensionHandlerMixin, JupyterHandler):
-    def initialize(self, name, handler):
+class OrderedHandler(ExtensionHandlerMixin, JupyterHandler):
+    """Runs the handler on the executor, in order with the other requests from the same notebook."""
+
+    def initialize(self, name, handler, executor, key):
         self.handler = handler
+        self.executor = executor
+        self.key = key
         self.name = name
 
+    async def run(self, data):
+        # requests are ordered per OVE space, which the key resolves the notebook to
+        space = self.key(self.get_argument("notebook", ""), data)
+        return await self.executor.submit(space, self.handler, space, data)
+
+    def finish_queue_full(self, e: QueueFull):
+        # send_error would drop the Retry-After header
+        self.set_status(503)
+        self.set_header("Retry-After", "1")
+        self.finish(json.dumps({"error": str(e)}))
+
+
+class ConfigHandler(OrderedHandler):
     @tornado.web.authenticated
-    def post(self):
-        config = self.get_json_body()
-        self.handler(config)
+    async def post(self):
+        try:
+            await self.run(self.get_json_body())
+        except QueueFull as e:
+            return self.finish_queue_full(e)
         self.finish("{}")
 
 
-class TeeHandler(ExtensionHandlerMixin, JupyterHandler):
-    def initialize(self, name, handler):
-        self.handler = handler
-        self.name = name
+@tornado.web.stream_request_body
+class TeeHandler(OrderedHandler):
+    """Binary outputs sent as multipart parts are written to files while the body arrives, JSON is buffered."""
+
+    def initialize(self, name, handler, executor, key, upload_dir):
+        super().initialize(name, handler, executor, key)
+        self.upload_dir = upload_dir
+        self.chunks = []
+        self.parser = None
+        self.slot = None
+
+    async def prepare(self):
+        prepared = super().prepare()
+        if inspect.isawaitable(prepared):
+            await prepared
+        # the body is streamed to disk, so the user is checked before any of it is read
+        if self.current_user is None:
+            raise tornado.web.HTTPError(403)
+        # the place in the queue is taken on arrival, a large tee still streaming can't be overtaken by a later one
+        space = self.key(self.get_argument("notebook", ""))
+        try:
+            self.slot = self.executor.reserve(space)
+        except QueueFull as e:
+            return self.finish_queue_full(e)
+        boundary = get_boundary(self.request.headers.get("Content-Type"))
+        if boundary is not None:
+            self.parser = MultipartParser(boundary, self.upload_dir(space))
+
+    async def data_received(self, chunk):
+        if self.parser is None:
+            self.chunks.append(chunk)
+        else:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, self.parser.feed, chunk)
+
+    def on_connection_close(self):
+        # the body never finished, post clears self.parser once it has
+        if self.parser is not None:
+            self.parser.remove_uploads()
+        if self.slot is not None:
+            self.executor.release(self.slot)
 
     @tornado.web.authenticated
-    def post(self):
-        data = self.get_json_body()
-        self.finish(self.handler(data))
+    async def post(self):
+        parser, self.parser = self.parser, None
+        try:
+            if parser is None:
+                self.request.body = b"".join(self.chunks)
+                data = self.get_json_body()
+            else:
+                data = parser.get_data()
+            result = await self.executor.run(self.slot, self.handler, self.slot.key, data)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        finally:
+            # run releases the slot, unless the body couldn't be parsed
+            self.executor.release(self.slot)
+            if parser is not None:
+                parser.remove_uploads()
+        self.finish(result)
 
 
 class StaticHandler(tornado.web.StaticFileHandler):
@@ -49,6 +124,12 @@ class StaticHandler(tornado.web.StaticFileHandler):
         self.set_header("Access-Control-Allow-Headers", "*")
         self.set_header("Access-Control-Allow-Methods", "*")
 
+    def get_cache_time(self, path, modified, mime_type):
+        # content addressed assets and tile pyramids never change under the same name
+        if is_immutable(path):
+            return self.CACHE_MAX_AGE
+        return super().get_cache_time(path, modified, mime_type)
+
 
 class ModeHandler(ExtensionHandlerMixin, JupyterHandler):
     def initialize(self, name, handler):
@@ -56,4 +137,14 @@ class ModeHandler(ExtensionHandlerMixin, JupyterHandler):
         self.handler = handler
     @tornado.web.authenticated
     def get(self):
-        self.finish(self.handler().value)
\ No newline at end of file
+        self.finish(self.handler(self.get_argument("notebook", "")).value)
+
+
+class StatsHandler(ExtensionHandlerMixin, JupyterHandler):
+    def initialize(self, name, handler):
+        self.name = name
+        self.handler = handler
+
+    @tornado.web.authenticated
+    def get(self, trace=None):
+        self.finish(self.handler(trace is not None))
@@ -0,0 +1,82 @@
+import sys
+import asyncio
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Slot:
+    """A call's place in its key's queue, taken when the request arrives and freed once the call has run."""
+
+    def __init__(self, key: str, previous: typing.Optional[asyncio.Future], done: asyncio.Future):
+        self.key = key
+        self.previous = previous
+        self.done = done
+        self.released = False
+
+
+class OrderedExecutor:
+    """Runs blocking calls off the IOLoop on a bounded thread pool.
+
+    Calls sharing a key run one at a time in the order their slots were reserved, calls with different keys run
+    concurrently. Once max_workers calls are running and max_queued are waiting, further reservations raise QueueFull.
+    Only used from the IOLoop thread, so the bookkeeping needs no locks.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ove-jupyter")
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.pending = 0
+        # key -> (done future of the last slot, slots not yet released)
+        self.keys = {}
+
+    def reserve(self, key: str) -> Slot:
+        if self.pending >= self.max_workers + self.max_queued:
+            raise QueueFull(f"{self.pending} OVE requests are already in progress")
+        self.pending += 1
+        previous, users = self.keys.get(key, (None, 0))
+        slot = Slot(key, previous, asyncio.get_running_loop().create_future())
+        self.keys[key] = (slot.done, users + 1)
+        return slot
+
+    def release(self, slot: Slot) -> None:
+        """Frees the slot, also when its call never ran because the request failed or was dropped."""
+        if slot.released:
+            return
+        slot.released = True
+        self.pending -= 1
+        last, users = self.keys[slot.key]
+        if users == 1:
+            self.keys.pop(slot.key)
+        else:
+            self.keys[slot.key] = (last, users - 1)
+        # the next slot must not overtake one still waiting its turn
+        if slot.previous is None or slot.previous.done():
+            slot.done.set_result(None)
+        else:
+            slot.previous.add_done_callback(lambda _: slot.done.set_result(None))
+
+    async def run(self, slot: Slot, fn: typing.Callable, *args) -> typing.Any:
+        try:
+            if slot.previous is not None:
+                await asyncio.shield(slot.previous)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.release(slot)
+
+    async def submit(self, key: str, fn: typing.Callable, *args) -> typing.Any:
+        return await self.run(self.reserve(key), fn, *args)
+
+    def is_idle(self, key: str) -> bool:
+        return key not in self.keys
+
+    def shutdown(self) -> None:
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            self.executor.shutdown(wait=False)
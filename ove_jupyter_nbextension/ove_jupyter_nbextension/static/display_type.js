@@ -95,6 +95,7 @@ define([], function () {
     };
 
     return {
+        DataType,
         fromCellOutput,
         toDataType,
         formatCellOutput
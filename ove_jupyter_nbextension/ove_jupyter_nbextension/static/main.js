@@ -141,7 +141,7 @@ define([
 
     const config_handler = async config => {
         const body = $("body");
-        await fetch(`${body.data("baseUrl")}ove-jupyter/config`, {
+        await fetch(`${body.data("baseUrl")}ove-jupyter/config?${notebook_query()}`, {
             method: "POST",
             headers: {
                 "Authorization": `token ${body.data("jupyterApiToken")}`,
@@ -183,22 +183,47 @@ define([
         });
     });
 
+    // PNG / JPEG outputs are sent as raw bytes next to the JSON instead of as base64 inside it
+    const binary_types = {[dt.DataType.PNG]: "image/png", [dt.DataType.JPEG]: "image/jpeg"};
+    const to_blob = (data, mime) => fetch(`data:${mime};base64,${data}`).then(response => response.blob());
+
+    const to_form = async (config, outputs) => {
+        const blobs = [];
+        const parts = await Promise.all(outputs.map(async ([idx, data_type, data, metadata], i) => {
+            const mime = binary_types[data_type];
+            if (mime === undefined || typeof data !== "string") return [idx, data_type, data, metadata];
+            const name = `output-${i}`;
+            blobs.push([name, await to_blob(data, mime), `${name}.${data_type}`]);
+            return [idx, data_type, {part: name}, metadata];
+        }));
+        if (blobs.length === 0) return null;
+
+        const form = new FormData();
+        form.append("tee", JSON.stringify({config, outputs: parts}));
+        blobs.forEach(([name, blob, filename]) => form.append(name, blob, filename));
+        return form;
+    };
+
     const tee_handler = async (config, outputs) => {
         const body = $("body");
-        await fetch(`${body.data("baseUrl")}ove-jupyter/tee`, {
+        const headers = {
+            "Authorization": `token ${body.data("jupyterApiToken")}`,
+            "X-XSRFToken": getCookie("_xsrf")
+        };
+        const form = await to_form(config, outputs);
+        if (form === null) {
+            headers["Content-Type"] = "application/json";
+        }
+        await fetch(`${body.data("baseUrl")}ove-jupyter/tee?${notebook_query()}`, {
             method: "POST",
-            headers: {
-                "Authorization": `token ${body.data("jupyterApiToken")}`,
-                "X-XSRFToken": getCookie("_xsrf"),
-                "Content-Type": "application/json",
-            },
+            headers,
             credentials: "same-origin",
-            body: JSON.stringify({
-                config,
-                outputs
-            })
+            // the browser sets the multipart boundary itself
+            body: form === null ? JSON.stringify({config, outputs}) : form
         });
     };
+    // requests from one notebook are handled in order, different notebooks concurrently
+    const notebook_query = () => `notebook=${encodeURIComponent(Jupyter.notebook.notebook_path)}`;
     const getCookie = name => document.cookie.match('\\b' + name + '=([^;]*)\\b')?.[1];
 
     const initialize = () => {
@@ -208,7 +233,8 @@ define([
             try {
                 const metadata = cell.metadata.ove_jupyter;
                 if (metadata === null || metadata === undefined) return;
-                const outputs = JSON.parse(JSON.stringify(cell))["outputs"];
+                // shallow copies, format_outputs replaces data without touching the notebook's own outputs
+                const outputs = cell.output_area.outputs.map(output => ({...output}));
                 const formatted_outputs = format_outputs(outputs);
                 tee_handler(metadata, formatted_outputs).catch(console.error);
             } catch (e) {
@@ -1,58 +1,181 @@
 import os
 import re
+import glob
 import json
-import base64
+import shutil
+import typing
+import hashlib
+import binascii
 
 from .data_type import DataType
 from .utils import get_dir, OVEException
-from .file_handler import FileHandler
+from .asset_store import AssetStore
+from .file_handler import FileHandler, SIDECARS
+from .multipart import Upload
+from .tee_stats import TEE_STATS
+from .tile_pyramid import TilePyramid, get_image_size, get_files_dir
 
 
 class AssetHandler:
-    def __init__(self, out_dir: str, host: str, file_handler: FileHandler):
+    def __init__(self, out_dir: str, host: str, file_handler: FileHandler,
+                 asset_store: typing.Optional[AssetStore] = None, tiler: typing.Optional[TilePyramid] = None):
         self.file_handler = file_handler
+        self.asset_store = asset_store
+        self.tiler = tiler
         self.out_dir = out_dir
         self.host = host
+        self.versions = {}
 
     def handle_markdown_css(self) -> None:
         self.file_handler.copy(f"{get_dir()}/assets/markdown-github.css",
                                f"{self.out_dir}/markdown-github.css")
 
     def write_asset(self, data: str, cell_no: int, i: int, data_type: DataType) -> None:
+        if self.is_tiled(data, data_type):
+            return self._write_pyramid(data, cell_no, i)
+        if isinstance(data, Upload):
+            return self._write_upload(data, cell_no, i, data_type)
         if type(data) == str:
             if "http" == data[:4]:
                 return data
             elif re.match(r"^.?[/\w\- ]+\..+$", data) is not None:
+                if self.asset_store is not None:
+                    return self.asset_store.put_file(f"{cell_no}-{i}", os.path.abspath(data))
                 filename = self._get_filename(data, data_type, cell_no, i, is_raw=False)
-                self.file_handler.copy(os.path.abspath(data), f"{self.out_dir}/{filename}")
+                if self.file_handler.copy(os.path.abspath(data), f"{self.out_dir}/{filename}"):
+                    self.file_handler.write_compressed(f"{self.out_dir}/{filename}")
+                self._remove_stale(cell_no, i, filename)
                 return filename
         if data_type.is_media():
             raise OVEException("Raw data source not supported")
+        if self.asset_store is not None and self._is_base64(data_type):
+            return self.asset_store.put_base64(f"{cell_no}-{i}", data, data_type.get_file_extension())
+        elif self.asset_store is not None:
+            data, file_mode = self._format_asset(data, data_type)
+            return self.asset_store.put(f"{cell_no}-{i}", data, data_type.get_file_extension(), file_mode)
         filename = self._get_filename(data, data_type, cell_no, i, is_raw=True)
         self._write_asset(data, filename, data_type)
+        self._remove_stale(cell_no, i, filename)
         return filename
 
     def get_asset_url(self, asset_filename: str) -> str:
         if "http" == asset_filename[:4]:
             return asset_filename
+        # filenames are reused between runs, the version changes the url whenever the content does
+        version = self.versions.get(asset_filename, None)
+        if version is not None:
+            return f"{self.host}/{asset_filename}?v={version}"
         return f"{self.host}/{asset_filename}"
 
+    def is_tiled(self, data: typing.Any, data_type: DataType) -> bool:
+        """Whether the output is an image large enough to be displayed as a tile pyramid."""
+        if self.tiler is None or not self._is_base64(data_type):
+            return False
+        header = self._read_header(data)
+        return header is not None and self.tiler.is_large(get_image_size(header, self.tiler.max_pixels))
+
+    @staticmethod
+    def _read_header(data: typing.Any, size: int = 64 * 1024) -> typing.Optional[bytes]:
+        if isinstance(data, Upload):
+            path = data.path
+        elif type(data) != str or "http" == data[:4]:
+            return None
+        elif re.match(r"^.?[/\w\- ]+\..+$", data[:4096]) is not None:
+            path = os.path.abspath(data)
+        else:
+            try:
+                return binascii.a2b_base64(data[:size - size % 4])
+            except binascii.Error:
+                return None
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read(size)
+
+    def _write_pyramid(self, data: typing.Any, cell_no: int, i: int) -> str:
+        tmp = None
+        if isinstance(data, Upload):
+            source, digest = data.path, data.digest
+        elif re.match(r"^.?[/\w\- ]+\..+$", data[:4096]) is not None:
+            source, sha256 = os.path.abspath(data), hashlib.sha256()
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+        else:
+            sha256 = hashlib.sha256()
+            tmp = source = self.file_handler.decode_base64(data, self.out_dir, digest=sha256)
+            digest = sha256.hexdigest()
+
+        try:
+            with TEE_STATS.stage("tiles"):
+                if self.asset_store is not None:
+                    return self.asset_store.put_pyramid(f"{cell_no}-{i}", source, digest, self.tiler)
+                name = f"cell-{cell_no}-{i}-{digest[:12]}"
+                if not os.path.exists(f"{self.out_dir}/{name}.dzi"):
+                    TEE_STATS.add_bytes(self.tiler.write(source, self.out_dir, name))
+                self._remove_stale(cell_no, i, f"{name}.dzi")
+                return f"{name}.dzi"
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+            if isinstance(data, Upload):
+                data.remove()
+
+    def _remove_stale(self, cell_no: int, i: int, keep: str) -> None:
+        """Removes what the output was written as before, if it changed type (e.g. a PNG downscaled to JPEG) or was
+        tiled, the previous file is no longer displayed."""
+        for f in glob.glob(f"{self.out_dir}/cell-{cell_no}-{i}.*"):
+            name = os.path.basename(f)
+            for suffix in SIDECARS.values():
+                name = name[:-len(suffix)] if name.endswith(suffix) else name
+            if name != keep:
+                os.remove(f)
+        # pyramids are named after their content
+        for dzi in glob.glob(f"{self.out_dir}/cell-{cell_no}-{i}-*.dzi"):
+            if os.path.basename(dzi) == keep:
+                continue
+            os.remove(dzi)
+            if os.path.exists(get_files_dir(dzi)):
+                shutil.rmtree(get_files_dir(dzi))
+
     def _get_filename(self, data: str, data_type: DataType, cell_no: int, i: int, is_raw: bool) -> str:
         if is_raw:
             return f"cell-{cell_no}-{i}.{data_type.get_file_extension()}"
         else:
             return f"cell-{cell_no}-{i}.{data.split('.')[-1]}"
 
+    @staticmethod
+    def _is_base64(data_type: DataType) -> bool:
+        return data_type == DataType.PNG or data_type == DataType.JPEG
+
+    def _write_upload(self, upload: Upload, cell_no: int, i: int, data_type: DataType) -> str:
+        # already decoded and hashed while it was received, so it is only renamed into place
+        if self.asset_store is not None:
+            return self.asset_store.put_upload(f"{cell_no}-{i}", upload, data_type.get_file_extension())
+        filename = self._get_filename(upload.path, data_type, cell_no, i, is_raw=True)
+        upload.move(f"{self.out_dir}/{filename}")
+        self.versions[filename] = upload.digest[:12]
+        self._remove_stale(cell_no, i, filename)
+        return filename
+
     def _write_asset(self, data: str, filename: str, data_type: DataType) -> str:
+        if self._is_base64(data_type):
+            # streamed so a large image is never held decoded in memory
+            digest = hashlib.sha1()
+            self.file_handler.write_base64(data, f"{self.out_dir}/{filename}", digest=digest)
+            self.versions[filename] = digest.hexdigest()[:12]
+            return filename
+
         data, file_mode = self._format_asset(data, data_type)
 
         self.file_handler.to_file(data, f"{self.out_dir}/{filename}", file_mode)
+        self.file_handler.write_compressed(f"{self.out_dir}/{filename}")
+        self.versions[filename] = hashlib.sha1(data.encode("utf-8")).hexdigest()[:12]
         return filename
 
-    def _format_asset(self, data: str, data_type: DataType) -> tuple[str, str]:
-        if data_type == DataType.PNG or data_type == DataType.JPEG:
-            return base64.b64decode(data), "wb"
-        elif data_type == DataType.GEOJSON:
+    def _format_asset(self, data: typing.Any, data_type: DataType) -> tuple[str, str]:
+        if data_type == DataType.GEOJSON:
             return json.dumps(data, indent=4), "w"
         else:
             return data, "w"
@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import typing
+import shutil
+import hashlib
+
+from .file_handler import FileHandler, SIDECARS
+from .locks import ASSET_STORE_LOCK
+from .tee_stats import TEE_STATS
+from .multipart import Upload
+from .tile_pyramid import TilePyramid, is_tile, get_files_dir
+
+
+def is_blob(filename: str) -> bool:
+    return re.match(r"^[0-9a-f]{64}\.\w+$", filename) is not None
+
+
+def is_immutable(path: str) -> bool:
+    """Blobs and tile pyramids are named after their content, so can be cached forever."""
+    return is_blob(os.path.basename(path.split("?", 1)[0])) or is_tile(path)
+
+
+class AssetStore:
+    """Stores assets by content hash, refs maps each "{cell_no}-{i}" key to the blob it displays."""
+    INDEX = ".assets.json"
+
+    def __init__(self, out_dir: str, file_handler: FileHandler):
+        self.file_handler = file_handler
+        self.out_dir = out_dir
+        self.refs = self._load()
+
+    def _load(self) -> dict:
+        index = f"{self.out_dir}/{AssetStore.INDEX}"
+        return self.file_handler.read_json(index) if os.path.exists(index) else {}
+
+    def _save(self) -> None:
+        self.file_handler.write_json(self.refs, f"{self.out_dir}/{AssetStore.INDEX}")
+
+    def reset(self) -> None:
+        """Forgets every ref, once the space is cleared no blob from an earlier session is displayed."""
+        with ASSET_STORE_LOCK:
+            self.refs = {}
+            self._save()
+
+    def _reference(self, key: str, filename: str) -> str:
+        with ASSET_STORE_LOCK:
+            previous = self.refs.get(key, None)
+            self.refs[key] = filename
+            if previous is not None and previous != filename:
+                self._collect(previous)
+            self._save()
+        return filename
+
+    def _collect(self, filename: str) -> None:
+        if filename in self.refs.values():
+            return
+        for suffix in ("", *SIDECARS.values()):
+            if os.path.exists(f"{self.out_dir}/{filename}{suffix}"):
+                os.remove(f"{self.out_dir}/{filename}{suffix}")
+        if filename.endswith(".dzi") and os.path.exists(f"{self.out_dir}/{get_files_dir(filename)}"):
+            shutil.rmtree(f"{self.out_dir}/{get_files_dir(filename)}")
+
+    def put(self, key: str, data: typing.Union[str, bytes], ext: str, file_mode: str) -> str:
+        payload = data if file_mode == "wb" else data.encode("utf-8")
+        filename = f"{hashlib.sha256(payload).hexdigest()}.{ext}"
+        with ASSET_STORE_LOCK:
+            if not os.path.exists(f"{self.out_dir}/{filename}"):
+                self.file_handler.to_file(payload, f"{self.out_dir}/{filename}", "wb")
+                self.file_handler.write_compressed(f"{self.out_dir}/{filename}")
+        return self._reference(key, filename)
+
+    def put_base64(self, key: str, data: str, ext: str) -> str:
+        digest = hashlib.sha256()
+        tmp = self.file_handler.decode_base64(data, self.out_dir, digest=digest)
+        filename = f"{digest.hexdigest()}.{ext}"
+        with ASSET_STORE_LOCK:
+            if os.path.exists(f"{self.out_dir}/{filename}"):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, f"{self.out_dir}/{filename}")
+        return self._reference(key, filename)
+
+    def put_upload(self, key: str, upload: Upload, ext: str) -> str:
+        filename = f"{upload.digest}.{ext}"
+        with ASSET_STORE_LOCK:
+            if os.path.exists(f"{self.out_dir}/{filename}"):
+                upload.remove()
+            else:
+                upload.move(f"{self.out_dir}/{filename}")
+        return self._reference(key, filename)
+
+    def put_file(self, key: str, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        filename = f"{digest.hexdigest()}.{path.split('.')[-1]}"
+        with ASSET_STORE_LOCK:
+            if self.file_handler.copy(path, f"{self.out_dir}/{filename}"):
+                self.file_handler.write_compressed(f"{self.out_dir}/{filename}")
+        return self._reference(key, filename)
+
+    def put_pyramid(self, key: str, source: str, digest: str, tiler: TilePyramid) -> str:
+        filename = f"{digest}.dzi"
+        with ASSET_STORE_LOCK:
+            exists = os.path.exists(f"{self.out_dir}/{filename}")
+        if not exists:
+            # tiled outside the lock, write only moves the finished pyramid into place
+            TEE_STATS.add_bytes(tiler.write(source, self.out_dir, digest))
+        return self._reference(key, filename)
+
+    def release(self, keys: list[str]) -> None:
+        with ASSET_STORE_LOCK:
+            released = [self.refs.pop(k) for k in keys if k in self.refs]
+            for filename in released:
+                self._collect(filename)
+            self._save()
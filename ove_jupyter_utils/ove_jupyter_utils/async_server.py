@@ -0,0 +1,370 @@
+import io
+import os
+import sys
+import json
+import uuid
+import time
+import typing
+import asyncio
+import mimetypes
+import http.client
+import email.utils
+
+from http import HTTPStatus
+from traceback import format_exc
+from concurrent.futures import ThreadPoolExecutor
+
+from .asset_store import is_immutable
+from .file_handler import SIDECARS
+from .server_log import SERVER_LOG, SERVER_LOGGER
+from .multipart import UPLOAD_DIR, MultipartParser, get_boundary
+from .file_server import get_etag, get_encoding, is_authorized, is_not_modified, is_range_current, resolve_ranges, \
+    parse_range_header, translate_path
+
+
+class Response:
+    def __init__(self, code: int, headers: typing.Optional[list[tuple[str, str]]] = None, body: bytes = b"",
+                 file: typing.Optional[typing.BinaryIO] = None, ranges: typing.Optional[list[tuple[int, int]]] = None):
+        self.code = code
+        self.headers = headers if headers is not None else []
+        self.body = body
+        self.file = file
+        self.ranges = ranges
+        self.part_headers = []
+        self.part_footer = b""
+
+
+class AsyncServer:
+    """ Single threaded asyncio alternative to ThreadedHTTPServer.
+
+    Connections are capped at max_connections, a connection waiting longer than queue_timeout
+    for a slot is answered with 503. Responses are written with drain() so slow clients hold
+    back their own connection only, and file system and OVE work runs on executors instead of
+    the event loop.
+    """
+    max_ranges = 32
+    max_header_size = 64 * 1024
+
+    def __init__(self, directory: str, config: str, is_background: bool,
+                 dispatch: typing.Optional[typing.Callable] = None, max_connections: int = 256, workers: int = 4,
+                 queue_timeout: float = 10, idle_timeout: float = 30, max_body_size: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.config = config
+        self.is_background = is_background
+        self.dispatch = dispatch
+        self.max_connections = max_connections
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+        self.max_body_size = max_body_size
+        # stat, hashing and opening files, bounded so a burst of requests can't spawn unlimited threads
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="ove-static")
+        # the OVE handler is not thread safe, endpoints run one at a time in arrival order
+        self.dispatcher = ThreadPoolExecutor(1, thread_name_prefix="ove-dispatch")
+        self.connections = None
+
+    def serve_forever(self, port: int, host: str = "") -> None:
+        asyncio.run(self.serve(port, host))
+
+    async def serve(self, port: int, host: str = "") -> None:
+        self.connections = asyncio.Semaphore(self.max_connections)
+        server = await asyncio.start_server(self._handle_connection, host if host != "" else None, port,
+                                            limit=self.max_header_size)
+        if self.is_background:
+            SERVER_LOG.start(self.directory, self.config)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            SERVER_LOG.stop()
+            self.executor.shutdown(wait=False)
+            self.dispatcher.shutdown(wait=False)
+
+    def log_request(self, address: str, method: str, path: str, version: str, code: int, bytes_sent: int,
+                    start: float, headers: typing.Any) -> None:
+        if self.is_background:
+            SERVER_LOG.log_access(address, method, path, code, bytes_sent, start, headers)
+        else:
+            sys.stderr.write(f"{address} - - [{time.strftime('%d/%b/%Y %H:%M:%S')}] \"{method} {path} {version}\" "
+                             f"{code} {bytes_sent} {(time.perf_counter() - start) * 1000:.1f}ms\n")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        address = peer[0] if isinstance(peer, tuple) else str(peer)
+        try:
+            await asyncio.wait_for(self.connections.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            await self._close(writer, Response(503, [("Retry-After", "1")]))
+            return
+
+        try:
+            keep_alive = True
+            while keep_alive:
+                keep_alive = await self._handle_request(reader, writer, address)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.release()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _close(self, writer: asyncio.StreamWriter, response: Response) -> None:
+        try:
+            await self._send(writer, response, "HEAD", "", keep_alive=False)
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, address: str) -> bool:
+        """ Reads and answers one request, returns whether the connection should be kept open. """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return False
+        except asyncio.LimitOverrunError:
+            await self._send(writer, Response(431), "GET", "", keep_alive=False)
+            return False
+
+        request_line, _, raw_headers = head.partition(b"\r\n")
+        try:
+            method, path, version = request_line.decode("latin-1").split()
+            headers = http.client.parse_headers(io.BytesIO(raw_headers))
+        except (ValueError, http.client.HTTPException):
+            await self._send(writer, Response(400), "GET", "", keep_alive=False)
+            return False
+
+        connection = headers.get("Connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+        start = time.perf_counter()
+        body = b""
+        if method == "POST":
+            try:
+                length = int(headers.get("Content-Length", 0))
+            except ValueError:
+                await self._send(writer, Response(400), method, path, keep_alive=False)
+                return False
+            if length > self.max_body_size:
+                # the body is left unread so the connection can't be reused
+                await self._send(writer, Response(413), method, path, keep_alive=False)
+                return False
+            boundary = get_boundary(headers.get("Content-Type"))
+            if boundary is None:
+                body = await reader.readexactly(length)
+            elif not await asyncio.get_running_loop().run_in_executor(self.executor, is_authorized, self.config,
+                                                                      headers):
+                # checked before anything is written to disk
+                await self._send(writer, Response(401, [("WWW-Authenticate", "Basic")]), method, path,
+                                 keep_alive=False)
+                return False
+            else:
+                try:
+                    body = await self._read_multipart(reader, length, boundary)
+                except ValueError:
+                    await self._send(writer, Response(400), method, path, keep_alive=False)
+                    return False
+        try:
+            response = await self._get_response(method, path, headers, body)
+        finally:
+            if isinstance(body, MultipartParser):
+                body.remove_uploads()
+        bytes_sent = await self._send(writer, response, method, path, keep_alive)
+        self.log_request(address, method, path, version, response.code, bytes_sent, start, headers)
+        return keep_alive
+
+    async def _read_multipart(self, reader: asyncio.StreamReader, length: int, boundary: bytes) -> MultipartParser:
+        """ Streams binary parts to files as they arrive, see multipart.MultipartParser. """
+        loop = asyncio.get_running_loop()
+        parser = MultipartParser(boundary, os.path.join(self.directory, UPLOAD_DIR))
+        try:
+            while length > 0:
+                chunk = await reader.read(min(1024 * 1024, length))
+                if len(chunk) == 0:
+                    raise asyncio.IncompleteReadError(b"", length)
+                length -= len(chunk)
+                await loop.run_in_executor(self.executor, parser.feed, chunk)
+        except BaseException:
+            parser.remove_uploads()
+            raise
+        return parser
+
+    async def _get_response(self, method: str, path: str, headers: http.client.HTTPMessage,
+                            body: typing.Union[bytes, MultipartParser]) -> Response:
+        loop = asyncio.get_running_loop()
+        try:
+            if method == "OPTIONS":
+                return Response(200)
+            if not await loop.run_in_executor(self.executor, is_authorized, self.config, headers):
+                return Response(401, [("WWW-Authenticate", "Basic")])
+
+            if method == "POST":
+                if self.dispatch is None:
+                    return Response(501)
+                if isinstance(body, MultipartParser):
+                    data = body.get_data()
+                else:
+                    content = body.decode("utf-8")
+                    data = json.loads(content) if headers.get("Content-Type") == "application/json" else content
+                return self._get_result(
+                    await loop.run_in_executor(self.dispatcher, self.dispatch, method, path, data))
+
+            if method not in ("GET", "HEAD"):
+                return Response(501)
+            if self.dispatch is not None and method == "GET":
+                result = self.dispatch(method, path)
+                if result is not None:
+                    return self._get_result(result)
+            return await loop.run_in_executor(self.executor, self._open_static, path, headers)
+        except Exception as e:
+            if self.is_background:
+                SERVER_LOGGER.exception("%s %s failed", method, path)
+            else:
+                print(e)
+                print(format_exc())
+            return Response(500, [("Content-type", "text/html; charset=utf-8")], str(e).encode("utf-8"))
+
+    @staticmethod
+    def _get_result(result: tuple) -> Response:
+        code, data = result
+        if data is None:
+            return Response(code)
+        return Response(code, [("Content-type", "application/json; charset=utf-8")], json.dumps(data).encode("utf-8"))
+
+    def _open_static(self, url: str, headers: http.client.HTTPMessage) -> Response:
+        """ Same rules as BaseHandler.send_range_head, run on the executor. """
+        path = translate_path(self.directory, url)
+        if os.path.isdir(path):
+            if not url.split("?", 1)[0].endswith("/"):
+                return Response(301, [("Location", url + "/")])
+            for index in "index.html", "index.htm":
+                index = os.path.join(path, index)
+                if os.path.exists(index):
+                    path = index
+                    break
+            else:
+                return Response(403)
+
+        if not os.path.exists(path) and path.endswith('/data'):
+            # FIXME: Handle grits-like query with /data appended to path
+            if os.path.exists(path[:-5]):
+                path = path[:-5]
+
+        c_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return Response(404)
+
+        fs = os.fstat(f.fileno())
+        file_size = fs.st_size
+        etag = get_etag(path, fs)
+        try:
+            ranges = parse_range_header(headers.get("Range"), self.max_ranges)
+        except ValueError:
+            ranges = None
+        if ranges is not None and not is_range_current(headers, etag, fs):
+            ranges = None
+        encoding = None
+        is_encoded = any(os.path.exists(f"{path}{suffix}") for suffix in SIDECARS.values())
+        if ranges is None:
+            encoding = get_encoding(headers, path, fs)
+            if encoding is not None:
+                etag = f"{etag[:-1]}-{encoding}\""
+
+        validators = [("ETag", etag), ("Last-Modified", email.utils.formatdate(fs.st_mtime, usegmt=True))]
+        if is_encoded:
+            validators.append(("Vary", "Accept-Encoding"))
+        if is_not_modified(headers, etag, fs):
+            f.close()
+            return Response(304, validators)
+
+        if encoding is not None:
+            f.close()
+            f = open(f"{path}{SIDECARS[encoding]}", "rb")
+            file_size = os.fstat(f.fileno()).st_size
+
+        if ranges is not None:
+            ranges = resolve_ranges(ranges, file_size)
+            if len(ranges) == 0:
+                f.close()
+                return Response(416, [("Content-Range", f"bytes */{file_size}")])
+
+        if ranges is None:
+            response = Response(200, [("Content-type", c_type)], file=f, ranges=[(0, file_size - 1)])
+        elif len(ranges) == 1:
+            response = Response(206, [("Content-type", c_type),
+                                      ("Content-Range", f"bytes {ranges[0][0]}-{ranges[0][1]}/{file_size}")],
+                                file=f, ranges=ranges)
+        else:
+            boundary = uuid.uuid4().hex
+            response = Response(206, [("Content-type", f"multipart/byteranges; boundary={boundary}")],
+                                file=f, ranges=ranges)
+            response.part_headers = [(f"--{boundary}\r\nContent-Type: {c_type}\r\n"
+                                      f"Content-Range: bytes {range_from}-{range_to}/{file_size}\r\n\r\n").encode("latin-1")
+                                     for range_from, range_to in ranges]
+            response.part_footer = f"--{boundary}--\r\n".encode("latin-1")
+        response.headers.append(("Accept-Ranges", "bytes"))
+        if encoding is not None:
+            response.headers.append(("Content-Encoding", encoding))
+        response.headers.extend(validators)
+        return response
+
+    @staticmethod
+    def _get_content_length(response: Response) -> int:
+        if response.file is None:
+            return len(response.body)
+        # Add 1 because ranges are inclusive
+        length = sum(1 + range_to - range_from for range_from, range_to in response.ranges)
+        if len(response.part_headers) > 0:
+            length += sum(len(part_header) + 2 for part_header in response.part_headers) + len(response.part_footer)
+        return length
+
+    async def _send(self, writer: asyncio.StreamWriter, response: Response, method: str, path: str,
+                    keep_alive: bool) -> int:
+        """ Writes the response, returns the number of body bytes sent. """
+        try:
+            phrase = HTTPStatus(response.code).phrase
+            lines = [f"HTTP/1.1 {response.code} {phrase}",
+                     f"Date: {email.utils.formatdate(time.time(), usegmt=True)}"]
+            lines.extend(f"{k}: {v}" for k, v in response.headers)
+            if response.code not in (204, 304):
+                lines.append(f"Content-Length: {self._get_content_length(response)}")
+            # content addressed assets and tile pyramids never change under the same name
+            if response.code in (200, 206) and is_immutable(path):
+                lines.append("Cache-Control: public, max-age=31536000, immutable")
+            lines.extend(["Access-Control-Allow-Origin: *", "Access-Control-Allow-Methods: *",
+                          "Access-Control-Allow-Headers: *", f"Connection: {'keep-alive' if keep_alive else 'close'}"])
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            if method == "HEAD":
+                await writer.drain()
+                return 0
+            elif response.file is None:
+                writer.write(response.body)
+                await writer.drain()
+                return len(response.body)
+            else:
+                return await self._send_file(writer, response)
+        finally:
+            if response.file is not None:
+                response.file.close()
+
+    @staticmethod
+    async def _send_file(writer: asyncio.StreamWriter, response: Response) -> int:
+        loop = asyncio.get_running_loop()
+        bytes_sent = 0
+        part_headers = response.part_headers if len(response.part_headers) > 0 else [None] * len(response.ranges)
+        for (range_from, range_to), part_header in zip(response.ranges, part_headers):
+            if part_header is not None:
+                writer.write(part_header)
+            await writer.drain()
+            if range_to >= range_from:
+                # zero copy where the transport allows it, chunked reads with flow control otherwise
+                bytes_sent += await loop.sendfile(writer.transport, response.file, range_from,
+                                                  1 + range_to - range_from)
+            if part_header is not None:
+                writer.write(b"\r\n")
+                bytes_sent += len(part_header) + 2
+        writer.write(response.part_footer)
+        await writer.drain()
+        return bytes_sent + len(response.part_footer)
@@ -1,14 +1,30 @@
 import os
 import glob
+import gzip
 import json
+import time
 import shutil
 import typing
+import binascii
+import tempfile
+
+from .tee_stats import TEE_STATS
+from .multipart import UPLOAD_DIR
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# precompressed copies served by the file server, in order of preference
+SIDECARS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE = (".html", ".json", ".geojson", ".svg", ".css", ".js")
 
 
 class FileHandler:
     def read_file(self, filename: str) -> str:
         with open(filename) as f:
-            return "".join(f.readlines())
+            return f.read()
 
     def mkdir(self, dir_: str) -> None:
         if not os.path.exists(dir_):
@@ -22,22 +38,88 @@ class FileHandler:
         with open(filename, "w") as f:
             json.dump(obj, f, indent=indent)
 
-    def copy(self, in_: str, out_: str, overwrite: bool = False):
+    def copy(self, in_: str, out_: str, overwrite: bool = False) -> bool:
         if os.path.exists(out_) and not overwrite:
-            return
+            return False
         else:
             shutil.copy(in_, out_)
+            TEE_STATS.add_bytes(os.path.getsize(out_))
+            return True
 
     def to_file(self, obj: typing.Any, filename: str, file_mode: str) -> None:
         with open(f"{filename}", file_mode) as f:
             f.write(obj)
+        TEE_STATS.add_bytes(os.path.getsize(filename))
+
+    def decode_base64(self, data: str, dir_: str, chunk_size: int = 1024 * 1024, digest: typing.Any = None) -> str:
+        """Decodes base64 into a temporary file in dir_ one chunk at a time and returns its path."""
+        fd, tmp = tempfile.mkstemp(dir=dir_, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                carry = b""
+                for start in range(0, len(data), chunk_size):
+                    # whitespace is dropped, so whatever does not fill a 4 character quantum is carried over
+                    chunk = carry + data[start:start + chunk_size].encode("ascii").translate(None, b" \t\r\n")
+                    usable = len(chunk) - len(chunk) % 4
+                    decoded = binascii.a2b_base64(chunk[:usable])
+                    carry = chunk[usable:]
+                    if digest is not None:
+                        digest.update(decoded)
+                    f.write(decoded)
+                if len(carry) > 0:
+                    raise binascii.Error("Incorrect padding")
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return tmp
+
+    def write_base64(self, data: str, filename: str, chunk_size: int = 1024 * 1024, digest: typing.Any = None) -> None:
+        tmp = self.decode_base64(data, os.path.dirname(filename) or ".", chunk_size, digest)
+        TEE_STATS.add_bytes(os.path.getsize(tmp))
+        os.replace(tmp, filename)
+
+    def write_atomic(self, data: bytes, filename: str) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        TEE_STATS.add_bytes(len(data))
+        os.replace(tmp, filename)
+
+    def write_compressed(self, filename: str, min_size: int = 1024) -> None:
+        """Writes gzip (and brotli if installed) copies next to a text asset for the file server to send as is."""
+        for suffix in SIDECARS.values():
+            if os.path.exists(f"{filename}{suffix}"):
+                os.remove(f"{filename}{suffix}")
+        if not filename.endswith(COMPRESSIBLE) or os.path.getsize(filename) < min_size:
+            return
+
+        with open(filename, "rb") as f:
+            data = f.read()
+        self.write_atomic(gzip.compress(data, compresslevel=9, mtime=0), f"{filename}{SIDECARS['gzip']}")
+        if brotli is not None:
+            self.write_atomic(brotli.compress(data), f"{filename}{SIDECARS['br']}")
 
     def rm(self, dir_: str) -> None:
         for f in glob.glob(f"{dir_}/*"):
-            os.remove(f)
+            # tile pyramids are directories
+            if os.path.isdir(f):
+                shutil.rmtree(f)
+            else:
+                os.remove(f)
+
+    def remove_uploads(self, upload_dir: str, max_age: float = 3600) -> None:
+        """Removes parts a crashed server left behind, parts still being received were modified recently."""
+        for f in glob.glob(f"{upload_dir}/*"):
+            try:
+                if time.time() - os.path.getmtime(f) > max_age:
+                    os.remove(f)
+            except FileNotFoundError:
+                # moved into place meanwhile
+                pass
 
     def load_dir(self, out_dir: str, remove: bool) -> None:
         self.mkdir(out_dir)
+        self.remove_uploads(f"{out_dir}/{UPLOAD_DIR}")
 
         if remove:
             self.rm(out_dir)
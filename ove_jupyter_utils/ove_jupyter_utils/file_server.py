@@ -1,39 +1,110 @@
+import io
 import os
+import base64
 import re
 import sys
+import uuid
+import hmac
 import html
 import errno
-import logging
+import time
+import typing
 import argparse
+import threading
+import email.utils
 
-from io import StringIO
 from dotenv import dotenv_values
 from socketserver import ThreadingMixIn
 from urllib.parse import quote, unquote
 from http.server import SimpleHTTPRequestHandler, HTTPServer
 
+from .asset_store import is_blob, is_immutable
+from .file_handler import SIDECARS
+from .server_log import SERVER_LOG, SERVER_LOGGER
 
-class BaseHandler(SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.is_background = kwargs["is_background"]
-        self.config = kwargs["config"]
-        self.directory = kwargs["directory"]
-        super().__init__(*args, directory=kwargs["directory"], **kwargs)
 
-    def is_authorized(self):
+def get_etag(path: str, fs: os.stat_result) -> str:
+    """Strong ETag from the file's identity, no byte of it is read. Assets are replaced with os.replace, so a rewrite
+    gets a new inode even within the mtime resolution."""
+    name = os.path.basename(path)
+    if is_blob(name):
+        return f"\"{name.split('.')[0]}\""
+    return f"\"{fs.st_ino:x}-{fs.st_size:x}-{fs.st_mtime_ns:x}\""
+
+
+class Credentials:
+    """ OVE_USERNAME and OVE_PASSWORD from an env file, parsed again only when the file changes. """
+
+    def __init__(self, config: str):
+        self.config = config
+        self.lock = threading.Lock()
+        self.version = ()
+        self.token = None
+
+    def _get_version(self) -> typing.Optional[tuple]:
+        try:
+            fs = os.stat(self.config)
+        except OSError:
+            return None
+        return fs.st_mtime_ns, fs.st_size, fs.st_ino
+
+    def _load(self) -> typing.Optional[bytes]:
         config = {k: v for k, v in dotenv_values(self.config).items() if "OVE_" == k[:4]}
         username = config.get("OVE_USERNAME", None)
         password = config.get("OVE_PASSWORD", None)
 
         if username is None and password is None:
-            return True
+            return None
 
         if username is None and password is not None or username is not None and password is None:
             raise Exception("Please provide both a username and a password")
 
-        auth = self.headers.get("Authorized")
-        return not (auth is None or not auth.startswith("Basic") or auth[6:] != base64.b64decode(
-            f"{self.username}:{self.password}"))
+        encoded = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+        return f"Basic {encoded}".encode("ascii")
+
+    def get_token(self) -> typing.Optional[bytes]:
+        """ Expected Authorization header, None if auth is off. """
+        version = self._get_version()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.token = self._load()
+                    self.version = version
+        return self.token
+
+    def is_authorized(self, auth: typing.Optional[str]) -> bool:
+        token = self.get_token()
+        if token is None:
+            return True
+        # constant time so the token can't be guessed from response times
+        return auth is not None and hmac.compare_digest(auth.encode("utf-8"), token)
+
+
+# env file -> Credentials
+CREDENTIALS = {}
+CREDENTIALS_LOCK = threading.Lock()
+
+
+def get_credentials(config: str) -> Credentials:
+    credentials = CREDENTIALS.get(config, None)
+    if credentials is None:
+        with CREDENTIALS_LOCK:
+            credentials = CREDENTIALS.setdefault(config, Credentials(config))
+    return credentials
+
+
+class BaseHandler(SimpleHTTPRequestHandler):
+    use_sendfile = True
+    max_ranges = 32
+
+    def __init__(self, *args, **kwargs):
+        self.is_background = kwargs["is_background"]
+        self.config = kwargs["config"]
+        self.directory = kwargs["directory"]
+        super().__init__(*args, directory=kwargs["directory"], **kwargs)
+
+    def is_authorized(self):
+        return is_authorized(self.config, self.headers)
 
     def send_unauthorised(self) -> None:
         self.send_response(401)
@@ -44,62 +115,126 @@ class BaseHandler(SimpleHTTPRequestHandler):
         if not self.is_authorized():
             self.send_unauthorised()
             return
-        self.range_from, self.range_to = self._get_range_header()
-        if self.range_from is None:
-            # nothing to do here
-            return SimpleHTTPRequestHandler.do_GET(self)
+        self.ranges = self._get_range_header()
         f = self.send_range_head()
         if f:
-            self.copy_file_range(f, self.wfile)
-            f.close()
+            try:
+                if self.ranges is None:
+                    self.copyfile(f, self.wfile)
+                elif len(self.ranges) == 1:
+                    self.copy_file_range(f, self.wfile)
+                else:
+                    self.copy_multipart_range(f, self.wfile)
+            finally:
+                f.close()
 
     def do_HEAD(self) -> None:
         if not self.is_authorized():
             self.send_unauthorised()
             return
-        self.range_from, self.range_to = self._get_range_header()
-        if self.range_from is None:
-            return SimpleHTTPRequestHandler.do_HEAD(self)
+        self.ranges = self._get_range_header()
         f = self.send_range_head()
         if f:
             f.close()
 
+    def send_response(self, code: int, message: str = None) -> None:
+        self.response_code = code
+        SimpleHTTPRequestHandler.send_response(self, code, message)
+
     def end_headers(self) -> None:
+        # content addressed assets and tile pyramids never change under the same name
+        if getattr(self, "response_code", None) in (200, 206) and is_immutable(self.path):
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "*")
         self.send_header("Access-Control-Allow-Headers", "*")
         SimpleHTTPRequestHandler.end_headers(self)
 
+    def handle_one_request(self) -> None:
+        self.start_time = time.perf_counter()
+        self.bytes_sent = 0
+        self.response_code = None
+        SimpleHTTPRequestHandler.handle_one_request(self)
+        # the access line is written once the body has gone out so it has the latency and size
+        if self.is_background and self.response_code is not None:
+            # a request rejected before it was parsed (414, bad version) has no path or headers
+            SERVER_LOG.log_access(self.address_string(), getattr(self, "command", None) or "-",
+                                  getattr(self, "path", "-"), self.response_code, self.bytes_sent, self.start_time,
+                                  getattr(self, "headers", None))
+
+    def log_request(self, code: typing.Any = "-", size: typing.Any = "-") -> None:
+        if not self.is_background:
+            SimpleHTTPRequestHandler.log_request(self, code, size)
+
+    def log_error(self, format: str, *args) -> None:
+        if self.is_background:
+            SERVER_LOGGER.warning(format, *args)
+        else:
+            SimpleHTTPRequestHandler.log_error(self, format, *args)
+
     def log_message(self, format: str, *args) -> None:
         if self.is_background:
-            logging.basicConfig(filename=f"{self.directory}/server.log",
-                                filemode='a',
-                                format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(thread)d %(message)s',
-                                datefmt='%H:%M:%S',
-                                level=logging.DEBUG)
-            logger = logging.getLogger("server")
-            logger.info(format % args)
-            logger.info(self.headers)
+            SERVER_LOGGER.info(format, *args)
         else:
             SimpleHTTPRequestHandler.log_message(self, format, *args)
 
+    def copyfile(self, source, outputfile):
+        """ Send a whole file, with sendfile if it is a file on disk. """
+        try:
+            file_size = os.fstat(source.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            start = source.tell()
+            SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+            self.bytes_sent += source.tell() - start
+            return
+        self.send_file_range(source, outputfile, 0, file_size)
+
     def copy_file_range(self, in_file, out_file):
         """ Copy only the range in self.range_from/to. """
-        in_file.seek(self.range_from)
         # Add 1 because the range is inclusive
-        left_to_copy = 1 + self.range_to - self.range_from
+        return self.send_file_range(in_file, out_file, self.range_from, 1 + self.range_to - self.range_from)
+
+    def copy_multipart_range(self, in_file, out_file):
+        """ Copy every range in self.ranges as a multipart/byteranges body. """
+        bytes_copied = 0
+        for (range_from, range_to), part_header in zip(self.ranges, self.part_headers):
+            out_file.write(part_header)
+            bytes_copied += self.send_file_range(in_file, out_file, range_from, 1 + range_to - range_from)
+            out_file.write(b"\r\n")
+        out_file.write(self.part_footer)
+        self.bytes_sent += sum(len(part_header) + 2 for part_header in self.part_headers) + len(self.part_footer)
+        return bytes_copied
+
+    def send_file_range(self, in_file, out_file, offset: int, count: int) -> int:
+        """ Copy count bytes from offset, zero copy with sendfile when writing
+        straight to the client socket, buffered otherwise.
+        """
+        if count <= 0:
+            return 0
+        if self.use_sendfile and out_file is self.wfile:
+            try:
+                # socket.sendfile falls back to send() itself where os.sendfile can't be used
+                sent = self.connection.sendfile(in_file, offset, count)
+            except (BrokenPipeError, ConnectionResetError):
+                return 0
+            self.bytes_sent += sent
+            return sent
+
+        in_file.seek(offset)
         buf_length = 64 * 1024
         bytes_copied = 0
-        while bytes_copied < left_to_copy:
-            read_buf = in_file.read(min(buf_length, left_to_copy))
+        while bytes_copied < count:
+            read_buf = in_file.read(min(buf_length, count - bytes_copied))
             if len(read_buf) == 0:
                 break
             try:
                 out_file.write(read_buf)
             except IOError as e:
                 if e.errno == errno.EPIPE:
-                    pass
+                    break
+                raise
             bytes_copied += len(read_buf)
+        self.bytes_sent += bytes_copied
         return bytes_copied
 
     def send_range_head(self):
@@ -125,6 +260,7 @@ class BaseHandler(SimpleHTTPRequestHandler):
                     path = index
                     break
             else:
+                self.ranges = None
                 return SimpleHTTPRequestHandler.list_directory(self, path)
 
         if not os.path.exists(path) and path.endswith('/data'):
@@ -143,17 +279,61 @@ class BaseHandler(SimpleHTTPRequestHandler):
             self.send_error(404, "File not found")
             return None
 
-        if self.range_from is None:
+        fs = os.fstat(f.fileno())
+        file_size = fs.st_size
+        etag = get_etag(path, fs)
+        if self.ranges is not None and not self._is_range_current(etag, fs):
+            self.ranges = None
+        encoding = None
+        is_encoded = any(os.path.exists(f"{path}{suffix}") for suffix in SIDECARS.values())
+        if self.ranges is None:
+            encoding = self._get_encoding(path, fs)
+            if encoding is not None:
+                etag = f"{etag[:-1]}-{encoding}\""
+
+        if self._is_not_modified(etag, fs):
+            f.close()
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+            if is_encoded:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        if encoding is not None:
+            f.close()
+            f = open(f"{path}{SIDECARS[encoding]}", "rb")
+            file_size = os.fstat(f.fileno()).st_size
+
+        if self.ranges is not None:
+            self.ranges = self._resolve_ranges(self.ranges, file_size)
+            if len(self.ranges) == 0:
+                f.close()
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{file_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            self.range_from, self.range_to = self.ranges[0]
+
+        if self.ranges is None:
             self.send_response(200)
         else:
             self.send_response(206)
 
-        self.send_header("Content-type", c_type)
-        fs = os.fstat(f.fileno())
-        file_size = fs.st_size
-        if self.range_from is not None:
-            if self.range_to is None or self.range_to >= file_size:
-                self.range_to = file_size - 1
+        if self.ranges is not None and len(self.ranges) > 1:
+            boundary = uuid.uuid4().hex
+            self.part_headers = [(f"--{boundary}\r\nContent-Type: {c_type}\r\n"
+                                  f"Content-Range: bytes {range_from}-{range_to}/{file_size}\r\n\r\n").encode("latin-1")
+                                 for range_from, range_to in self.ranges]
+            self.part_footer = f"--{boundary}--\r\n".encode("latin-1")
+            content_length = sum(len(part_header) + 1 + range_to - range_from + 2
+                                 for (range_from, range_to), part_header in zip(self.ranges, self.part_headers))
+            self.send_header("Content-type", f"multipart/byteranges; boundary={boundary}")
+            self.send_header("Content-Length", str(content_length + len(self.part_footer)))
+        elif self.ranges is not None:
+            self.send_header("Content-type", c_type)
             self.send_header("Content-Range",
                              "bytes %d-%d/%d" % (self.range_from,
                                                  self.range_to,
@@ -162,7 +342,14 @@ class BaseHandler(SimpleHTTPRequestHandler):
             self.send_header("Content-Length",
                              (1 + self.range_to - self.range_from))
         else:
+            self.send_header("Content-type", c_type)
             self.send_header("Content-Length", str(file_size))
+        self.send_header("Accept-Ranges", "bytes")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        if is_encoded:
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", etag)
         self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
         self.end_headers()
         return f
@@ -170,51 +357,163 @@ class BaseHandler(SimpleHTTPRequestHandler):
     def translate_path(self, path):
         """ Override to handle redirects.
         """
-        path = path.split('?', 1)[0]
-        path = path.split('#', 1)[0]
-        path = os.path.normpath(unquote(path))
-        words = path.split('/')
-        words = filter(None, words)
-        path = self.directory
-        for word in words:
-            drive, word = os.path.splitdrive(word)
-            head, word = os.path.split(word)
-            if word in (os.path.curdir, os.path.pardir): continue
-            path = os.path.join(path, word)
-        return path
+        return translate_path(self.directory, path)
 
     # Private interface ######################################################
 
+    def _get_encoding(self, path: str, fs: os.stat_result) -> typing.Optional[str]:
+        return get_encoding(self.headers, path, fs)
+
+    def _is_not_modified(self, etag: str, fs: os.stat_result) -> bool:
+        return is_not_modified(self.headers, etag, fs)
+
+    def _is_range_current(self, etag: str, fs: os.stat_result) -> bool:
+        return is_range_current(self.headers, etag, fs)
+
+    @staticmethod
+    def _resolve_ranges(ranges: list[tuple], file_size: int) -> list[tuple[int, int]]:
+        return resolve_ranges(ranges, file_size)
+
     def _get_range_header(self):
-        """ Returns request Range start and end if specified.
-        If Range header is not specified returns (None, None)
+        """ Returns the requested ranges as a list of (start, end) tuples,
+        start is None for a suffix range and end is None for an open range.
+        If Range header is not specified or can't be used returns None
         """
         range_header = self.headers.get("Range")
-        if range_header is None:
-            return (None, None)
-        if not range_header.startswith("bytes="):
-            self.log_message(f"Not implemented: parsing header Range: {range_header}")
-            return (None, None)
-        regex = re.compile(r"^bytes=(\d+)-(\d+)?")
-        range_thing = regex.search(range_header)
-        if range_thing:
-            from_val = int(range_thing.group(1))
-            if range_thing.group(2) is not None:
-                return (from_val, int(range_thing.group(2)))
-            else:
-                return (from_val, None)
-        else:
-            self.log_message('CANNOT PARSE RANGE HEADER:', range_header)
-            return (None, None)
+        try:
+            return parse_range_header(range_header, self.max_ranges)
+        except ValueError:
+            self.log_message("CANNOT PARSE RANGE HEADER: %s", range_header)
+            return None
+
+
+def is_authorized(config: str, headers: typing.Any) -> bool:
+    return get_credentials(config).is_authorized(headers.get("Authorization"))
+
+
+def get_encoding(headers: typing.Any, path: str, fs: os.stat_result) -> typing.Optional[str]:
+    """ Returns the preferred encoding with an up to date precompressed
+    copy on disk, or None to send the file as is.
+    """
+    accepted = {}
+    for token in headers.get("Accept-Encoding", "").split(","):
+        name, _, params = token.partition(";")
+        try:
+            q = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            q = 0.0
+        accepted[name.strip().lower()] = q
+
+    for encoding, suffix in SIDECARS.items():
+        if accepted.get(encoding, accepted.get("*", 0.0)) <= 0.0 or not os.path.exists(f"{path}{suffix}"):
+            continue
+        # a copy older than the file it was made from is stale
+        if os.stat(f"{path}{suffix}").st_mtime_ns >= fs.st_mtime_ns:
+            return encoding
+    return None
+
+
+def is_not_modified(headers: typing.Any, etag: str, fs: os.stat_result) -> bool:
+    """ If-None-Match takes precedence over If-Modified-Since. """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, IndexError, OverflowError, ValueError):
+        return False
+    return since is not None and int(fs.st_mtime) <= since.timestamp()
+
+
+def is_range_current(headers: typing.Any, etag: str, fs: os.stat_result) -> bool:
+    """ If-Range: the range only applies if the validator still matches,
+    otherwise the whole file is sent.
+    """
+    if_range = headers.get("If-Range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith("\"") or if_range.startswith("W/"):
+        # strong comparison, a weak tag never matches
+        return if_range == etag
+    return if_range == email.utils.formatdate(fs.st_mtime, usegmt=True)
+
+
+def resolve_ranges(ranges: list[tuple], file_size: int) -> list[tuple[int, int]]:
+    """ Turns parsed ranges into inclusive offsets within the file,
+    dropping the unsatisfiable ones.
+    """
+    resolved = []
+    for range_from, range_to in ranges:
+        if range_from is None:
+            # suffix range, the last range_to bytes
+            if range_to == 0:
+                continue
+            resolved.append((max(0, file_size - range_to), file_size - 1))
+        elif range_from < file_size:
+            resolved.append((range_from, file_size - 1 if range_to is None or range_to >= file_size else range_to))
+    return resolved
+
+
+def parse_range_header(range_header: typing.Optional[str], max_ranges: int) -> typing.Optional[list[tuple]]:
+    """ Parses a bytes Range header, None if there is none or it can't be used.
+    Raises ValueError if it is malformed.
+    """
+    if range_header is None or not range_header.startswith("bytes="):
+        return None
+    ranges = []
+    for range_spec in range_header[6:].split(","):
+        range_thing = re.match(r"^\s*(\d*)-(\d*)\s*$", range_spec)
+        if range_thing is None or range_thing.group(1) == range_thing.group(2) == "":
+            raise ValueError(f"Invalid range: {range_spec}")
+        from_val = int(range_thing.group(1)) if range_thing.group(1) != "" else None
+        to_val = int(range_thing.group(2)) if range_thing.group(2) != "" else None
+        if from_val is not None and to_val is not None and to_val < from_val:
+            return None
+        ranges.append((from_val, to_val))
+    if len(ranges) > max_ranges:
+        return None
+    return ranges
+
+
+def translate_path(directory: str, path: str) -> str:
+    path = path.split('?', 1)[0]
+    path = path.split('#', 1)[0]
+    path = os.path.normpath(unquote(path))
+    words = path.split('/')
+    words = filter(None, words)
+    path = directory
+    for word in words:
+        drive, word = os.path.splitdrive(word)
+        head, word = os.path.split(word)
+        if word in (os.path.curdir, os.path.pardir): continue
+        path = os.path.join(path, word)
+    return path
 
 
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle requests in a separate thread."""
+    # the default of 5 drops connections when a whole wall of browsers connects at once
+    request_queue_size = 128
 
 
-def create_server(port, out, config, is_background):
+def create_server(port, out, config, is_background, server_mode="threaded", max_connections=256, workers=4):
+    if server_mode == "async":
+        from .async_server import AsyncServer
+        AsyncServer(out, config, is_background, max_connections=max_connections, workers=workers).serve_forever(port)
+        return
     server = ThreadedHTTPServer(("", port), handler_from(out, is_background, config))
-    server.serve_forever()
+    if is_background:
+        SERVER_LOG.start(out, config)
+    try:
+        server.serve_forever()
+    finally:
+        SERVER_LOG.stop()
 
 
 def handler_from(directory, is_background, config):
@@ -251,9 +550,13 @@ def get_parser() -> argparse.ArgumentParser:
     parser.add_argument("-p", "--port", default=8000, type=port_regex, nargs="?")
     parser.add_argument("-o", "--out", default=".ove", type=is_valid_dir, nargs="?")
     parser.add_argument("-e", "--env", default=".env", type=is_valid_file, nargs="?")
+    parser.add_argument("-s", "--server", default="threaded", choices=["threaded", "async"], nargs="?")
+    parser.add_argument("-c", "--max-connections", default=256, type=int, nargs="?")
+    parser.add_argument("-w", "--workers", default=4, type=int, nargs="?")
     return parser
 
 
 if __name__ == "__main__":
     args = get_parser().parse_args()
-    create_server(args.port, args.out, args.env, is_background=False)
+    create_server(args.port, args.out, args.env, is_background=False, server_mode=args.server,
+                  max_connections=args.max_connections, workers=args.workers)
@@ -0,0 +1,96 @@
+import io
+import os
+import base64
+import typing
+import hashlib
+import tempfile
+
+from .data_type import DataType
+from .multipart import Upload
+from .file_handler import FileHandler
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def is_resize_available() -> bool:
+    return Image is not None
+
+
+class ImageResizer:
+    """Downscales base64 PNG / JPEG outputs to the pixel size of the section they are displayed in."""
+
+    def __init__(self, quality: int = 85, image_format: typing.Optional[str] = None, scale: float = 1.0,
+                 tmp_dir: typing.Optional[str] = None):
+        self.file_handler = FileHandler()
+        self.tmp_dir = tmp_dir if tmp_dir is not None else tempfile.gettempdir()
+        self.quality = quality
+        self.image_format = image_format
+        self.scale = scale
+        self.savings = []
+
+    def resize(self, data: typing.Any, data_type: DataType, width: float, height: float,
+               name: str) -> tuple[typing.Any, DataType]:
+        if Image is None or (data_type != DataType.PNG and data_type != DataType.JPEG):
+            return data, data_type
+        if isinstance(data, Upload):
+            # opened from its file, the upload is never held in memory whole
+            return self._resize(data, data.path, data_type, width, height, name)
+        elif type(data) != str or "http" == data[:4] or "." in data[:256]:
+            # urls and local file paths are passed through untouched, "." is not in the base64 alphabet
+            return data, data_type
+        # decoded in chunks to a file, like an asset written without downscaling
+        tmp = self.file_handler.decode_base64(data, self.tmp_dir)
+        try:
+            return self._resize(data, tmp, data_type, width, height, name)
+        finally:
+            os.remove(tmp)
+
+    def _resize(self, data: typing.Any, source: str, data_type: DataType, width: float, height: float,
+                name: str) -> tuple[typing.Any, DataType]:
+        size = os.path.getsize(source)
+        target = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+        try:
+            with Image.open(source) as image:
+                out_type = self._get_data_type(image, data_type)
+                if image.width <= target[0] and image.height <= target[1] and out_type == data_type:
+                    return data, data_type
+
+                # thumbnail keeps the aspect ratio and never upscales
+                image.thumbnail(target, Image.LANCZOS)
+                buffer = io.BytesIO()
+                if out_type == DataType.JPEG:
+                    image.convert("RGB").save(buffer, "JPEG", quality=self.quality, optimize=True, progressive=True)
+                else:
+                    image.save(buffer, "PNG", optimize=True)
+        except Image.DecompressionBombError:
+            # too many pixels to decode safely, sent as it is rather than failing the tee
+            return data, data_type
+
+        resized = buffer.getvalue()
+        if len(resized) >= size:
+            return data, data_type
+
+        self.savings.append({"asset": name, "before": size, "after": len(resized), "width": image.width,
+                             "height": image.height, "format": out_type.value})
+        if isinstance(data, Upload):
+            return self._to_upload(resized, os.path.dirname(data.path), out_type), out_type
+        return base64.b64encode(resized).decode("ascii"), out_type
+
+    @staticmethod
+    def _to_upload(resized: bytes, upload_dir: str, data_type: DataType) -> Upload:
+        # next to the original so it is renamed into place like any other upload
+        fd, path = tempfile.mkstemp(dir=upload_dir, suffix=f".{data_type.get_file_extension()}")
+        with os.fdopen(fd, "wb") as f:
+            f.write(resized)
+        return Upload(path, hashlib.sha256(resized).hexdigest(), len(resized))
+
+    def _get_data_type(self, image: typing.Any, data_type: DataType) -> DataType:
+        if self.image_format is None or self.image_format.lower() not in ("jpg", "jpeg"):
+            return data_type
+        # JPEG has no alpha channel, transparent images stay PNG
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            return data_type
+        return DataType.JPEG
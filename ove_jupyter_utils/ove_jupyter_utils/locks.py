@@ -2,3 +2,5 @@ import threading
 
 LATEX_LOCK = threading.RLock()
 MARKDOWN_LOCK = threading.RLock()
+ASSET_STORE_LOCK = threading.RLock()
+PILLOW_LIMIT_LOCK = threading.Lock()
@@ -0,0 +1,39 @@
+import time
+import typing
+import threading
+
+
+class MetadataCache:
+    """Renderer url, geometry and bounds per (core, observatory), reused by load_config for ttl seconds."""
+
+    def __init__(self, ttl: float = 300):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.ttl = ttl
+
+    def configure(self, ttl: float) -> None:
+        with self.lock:
+            self.ttl = ttl
+
+    def get(self, key: tuple) -> typing.Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+            fetched, metadata = entry
+            if time.monotonic() - fetched >= self.ttl:
+                self.entries.pop(key)
+                return None
+            return metadata
+
+    def put(self, key: tuple, metadata: dict) -> None:
+        with self.lock:
+            if self.ttl > 0:
+                self.entries[key] = (time.monotonic(), metadata)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+METADATA_CACHE = MetadataCache()
@@ -0,0 +1,175 @@
+import io
+import os
+import re
+import json
+import typing
+import hashlib
+import tempfile
+import http.client
+
+from .tee_stats import TEE_STATS
+
+# uploaded parts are written here, under the output directory so they can be renamed into place
+UPLOAD_DIR = ".uploads"
+
+
+def get_boundary(content_type: typing.Optional[str]) -> typing.Optional[bytes]:
+    if content_type is None or not content_type.lower().startswith("multipart/form-data"):
+        return None
+    match = re.search(r"boundary=\"?([^\";]+)\"?", content_type)
+    return None if match is None else match.group(1).encode("latin-1")
+
+
+class Upload:
+    """A binary output streamed to a file, passed through tee in place of its base64 data."""
+
+    def __init__(self, path: str, digest: str, size: int):
+        self.path = path
+        self.digest = digest
+        self.size = size
+
+    def __str__(self) -> str:
+        # used by get_fingerprint, so re-sending the same bytes is recognised as unchanged
+        return f"upload:{self.digest}"
+
+    def move(self, filename: str) -> None:
+        os.replace(self.path, filename)
+        TEE_STATS.add_bytes(self.size)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MultipartParser:
+    """Incremental multipart/form-data parser.
+
+    Parts with a filename are streamed to files in upload_dir, only the current chunk and the tail that could be the
+    start of a boundary are held in memory. Other parts are small JSON fields kept in memory up to max_field_size.
+    """
+    max_header_size = 16 * 1024
+
+    def __init__(self, boundary: bytes, upload_dir: str, max_field_size: int = 16 * 1024 * 1024):
+        self.delimiter = b"\r\n--" + boundary
+        # the first boundary has no preceding line break
+        self.buffer = b"\r\n"
+        self.upload_dir = upload_dir
+        self.max_field_size = max_field_size
+        self.state = "preamble"
+        self.fields = {}
+        self.uploads = {}
+        self.part = None
+
+    def feed(self, chunk: bytes) -> None:
+        self.buffer += chunk
+        while True:
+            if self.state == "preamble" or self.state == "body":
+                idx = self.buffer.find(self.delimiter)
+                if idx < 0:
+                    # anything that can't be the start of a delimiter is flushed
+                    keep = len(self.delimiter) - 1
+                    if len(self.buffer) > keep:
+                        self._write(self.buffer[:-keep])
+                        self.buffer = self.buffer[-keep:]
+                    return
+                self._write(self.buffer[:idx])
+                self.buffer = self.buffer[idx + len(self.delimiter):]
+                self._end_part()
+                self.state = "delimiter"
+            elif self.state == "delimiter":
+                if len(self.buffer) < 2:
+                    return
+                if self.buffer[:2] == b"--":
+                    self.state = "done"
+                elif self.buffer[:2] == b"\r\n":
+                    self.buffer = self.buffer[2:]
+                    self.state = "headers"
+                else:
+                    raise ValueError("Malformed multipart boundary")
+            elif self.state == "headers":
+                idx = self.buffer.find(b"\r\n\r\n")
+                if idx < 0:
+                    if len(self.buffer) > self.max_header_size:
+                        raise ValueError("Multipart headers too large")
+                    return
+                self._start_part(self.buffer[:idx + 2])
+                self.buffer = self.buffer[idx + 4:]
+                self.state = "body"
+            else:
+                # the epilogue is ignored
+                self.buffer = b""
+                return
+
+    def _start_part(self, raw_headers: bytes) -> None:
+        headers = http.client.parse_headers(io.BytesIO(raw_headers))
+        disposition = headers.get("Content-Disposition", "")
+        name = re.search(r"\bname=\"([^\"]*)\"", disposition)
+        filename = re.search(r"\bfilename=\"([^\"]*)\"", disposition)
+        if name is None:
+            raise ValueError("Multipart part without a name")
+        if filename is None:
+            self.part = (name.group(1), bytearray(), None, None)
+            return
+        ext = re.search(r"\.(\w+)$", filename.group(1))
+        os.makedirs(self.upload_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.upload_dir, suffix=f".{ext.group(1) if ext is not None else 'bin'}")
+        self.part = (name.group(1), os.fdopen(fd, "wb"), path, hashlib.sha256())
+
+    def _write(self, data: bytes) -> None:
+        if self.part is None or len(data) == 0:
+            return
+        _, sink, path, digest = self.part
+        if path is None:
+            if len(sink) + len(data) > self.max_field_size:
+                raise ValueError("Multipart field too large")
+            sink.extend(data)
+        else:
+            digest.update(data)
+            sink.write(data)
+
+    def _end_part(self) -> None:
+        if self.part is None:
+            return
+        name, sink, path, digest = self.part
+        self.part = None
+        if path is None:
+            self.fields[name] = bytes(sink)
+        else:
+            size = sink.tell()
+            sink.close()
+            self.uploads[name] = Upload(path, digest.hexdigest(), size)
+
+    def get_data(self) -> dict:
+        """The tee JSON with each {"part": name} output replaced by its Upload."""
+        if self.state != "done":
+            raise ValueError("Incomplete multipart body")
+        data = json.loads(self.fields["tee"])
+        for output in data.get("outputs", []):
+            if isinstance(output[2], dict) and "part" in output[2]:
+                output[2] = self.uploads[output[2]["part"]]
+        return data
+
+    def remove_uploads(self) -> None:
+        """Drops the parts that were not moved into place, e.g. outputs skipped as unchanged."""
+        if self.part is not None and self.part[2] is not None:
+            self.part[1].close()
+            os.remove(self.part[2])
+            self.part = None
+        for upload in self.uploads.values():
+            upload.remove()
+
+
+def read_multipart(rfile: typing.BinaryIO, length: int, boundary: bytes, upload_dir: str,
+                   chunk_size: int = 1024 * 1024) -> MultipartParser:
+    parser = MultipartParser(boundary, upload_dir)
+    try:
+        while length > 0:
+            chunk = rfile.read(min(chunk_size, length))
+            if len(chunk) == 0:
+                break
+            length -= len(chunk)
+            parser.feed(chunk)
+    except BaseException:
+        parser.remove_uploads()
+        raise
+    return parser
@@ -9,7 +9,12 @@ from .data_type import DataType
 from .file_handler import FileHandler
 from .utils import get_dir, get_source
 from .asset_handler import AssetHandler
+from .template_cache import TEMPLATE_CACHE, Template
 from .locks import LATEX_LOCK, MARKDOWN_LOCK
+from .render_cache import LATEX_CACHE, MARKDOWN_CACHE
+from .render_pool import get_render_pool, render_latex, render_markdown
+
+ASSETS_DIR = f"{get_dir()}/assets"
 
 
 class OutputFormatter:
@@ -17,54 +22,66 @@ class OutputFormatter:
         self.file_handler = file_handler
         self.asset_handler = asset_handler
 
+    @staticmethod
+    def get_template(name: str) -> Template:
+        return TEMPLATE_CACHE.get(f"{ASSETS_DIR}/{name}")
+
+    @staticmethod
+    def _render(fn: typing.Callable[[str], str], text: str) -> typing.Optional[str]:
+        pool = get_render_pool()
+        return None if pool is None else pool.render(fn, text)
+
     def format_geojson(self, geojson: str, metadata: dict) -> dict:
         if metadata["layer_options"].get("basemap_id", None) is not None:
             basemap = metadata["url_template"].replace("{basemap_id}", f"{metadata['layer_options']['basemap_id']}")
         else:
             basemap = metadata["url_template"]
-        outline = self.file_handler.read_file(f"{get_dir()}/assets/geojson_format.json")
-        return json.loads(outline.replace("%%basemap%%", basemap).replace("%%geojson%%", json.dumps(geojson)))
+        outline = self.get_template("geojson_format.json")
+        return json.loads(outline.substitute(basemap=basemap, geojson=json.dumps(geojson)))
 
     def format_dict(self, obj: typing.Union[dict, list]) -> str:
-        outline = self.file_handler.read_file(f"{get_dir()}/assets/dict_format.html")
-        return outline.replace("%%replace%%", json.dumps(obj, indent=4))
+        return self.get_template("dict_format.html").substitute(replace=json.dumps(obj, indent=4))
 
     def format_markdown(self, md: str) -> str:
-        with MARKDOWN_LOCK:
-            self.asset_handler.handle_markdown_css()
-            outline = self.file_handler.read_file(f"{get_dir()}/assets/markdown_format.html")
-            return outline.replace("%%replace%%", markdown(md))
+        self.asset_handler.handle_markdown_css()
+        rendered = MARKDOWN_CACHE.get(md)
+        if rendered is None:
+            rendered = self._render(render_markdown, md)
+            if rendered is None:
+                with MARKDOWN_LOCK:
+                    rendered = markdown(md)
+            MARKDOWN_CACHE.put(md, rendered)
+        return self.get_template("markdown_format.html").substitute(replace=rendered)
 
     def format_dataframe(self, html: str) -> str:
         html = html.replace("border=\"1\" ", "").replace(" style=\"text-align: right;\"", "")
         html = re.sub(r"<style .*>(?:.|\r|\n|\t)*</style>", "", html)
-        outline = self.file_handler.read_file(f"{get_dir()}/assets/dataframe_format.html")
-        return outline.replace("%%replace%%", html)
+        return self.get_template("dataframe_format.html").substitute(replace=html)
 
     def format_latex(self, latex: str) -> str:
-        with LATEX_LOCK:
-            latex = latex.replace("\\displaystyle ", "").replace("\\\\", "\\")
-            if "$$" not in latex:
-                latex = latex.replace("$", "$$")
-            latex = latex_to_html(latex)
-            outline = self.file_handler.read_file(f"{get_dir()}/assets/latex_format.html")
-            return outline.replace("%%replace%%", latex)
+        rendered = LATEX_CACHE.get(latex)
+        if rendered is None:
+            formatted = latex.replace("\\displaystyle ", "").replace("\\\\", "\\")
+            if "$$" not in formatted:
+                formatted = formatted.replace("$", "$$")
+            rendered = self._render(render_latex, formatted)
+            if rendered is None:
+                with LATEX_LOCK:
+                    rendered = latex_to_html(formatted)
+            LATEX_CACHE.put(latex, rendered)
+        return self.get_template("latex_format.html").substitute(replace=rendered)
 
     def format_html(self, html: str) -> str:
         html_format = "<!DOCTYPE html>\n<html lang=\"en\">"
         if len(html) > len(html_format) and html[:len(html_format)] == html_format:
             return html
 
-        outline = self.file_handler.read_file(f"{get_dir()}/assets/html_format.html")
-        return outline.replace("%%replace%%", html)
+        return self.get_template("html_format.html").substitute(replace=html)
 
     def format_overview(self, observatory: str, bounds: dict, sections: list) -> str:
-        outline = self.file_handler.read_file(f"{get_dir()}/assets/overview.html")
-        outline = outline.replace("const observatoryName = "";", f"const observatoryName = {observatory};")
-        outline = outline.replace("const observatory = {};", f"const observatory = {json.dumps(bounds, indent=2)};")
-        outline = outline.replace("const sections = [];",
-                                  f"const sections = {json.dumps(sections, indent=2)};")
-        return outline
+        return self.get_template("overview.html").substitute(observatory_name=json.dumps(observatory),
+                                                             observatory=json.dumps(bounds, indent=2),
+                                                             sections=json.dumps(sections, indent=2))
 
     def format_data(self, data: str, data_type: DataType, metadata: dict) -> str:
         if data_type == DataType.AUDIO:
@@ -1,75 +1,251 @@
 import re
 import uuid
+import typing
 
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
 
 from .geometry import Geometry
 from .data_type import DataType
 from .file_handler import FileHandler
+from .asset_store import AssetStore
 from .asset_handler import AssetHandler
 from .request_handler import RequestHandler
 from .section_builder import SectionBuilder
+from .image_resizer import ImageResizer, is_resize_available
+from .tile_pyramid import TilePyramid, is_tiling_available
+from .render_cache import LATEX_CACHE, MARKDOWN_CACHE
+from .render_pool import configure_render_pool
+from .tee_stats import TEE_STATS
+from .metadata_cache import METADATA_CACHE
+from .token_cache import TOKEN_CACHE
 from .layout_validator import LayoutValidator
 from .output_formatter import OutputFormatter
-from .utils import load_base_config, Mode, get_dir
+from .utils import load_base_config, Mode, get_dir, get_stale_keys, get_fingerprint
 
 
 class OVEHandler:
     def __init__(self):
         self.config = {}
+        self.handler = None
+        self.asset_store = None
+        self.startup = None
+        self.startup_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _clear(self, file_handler: FileHandler) -> None:
+        self.handler.clear_space()
+        if self.asset_store is not None:
+            # refs loaded from .assets.json point at sections that were just cleared, keeping them would keep their
+            # blobs forever
+            self.asset_store.reset()
+        file_handler.load_dir(self.config["out"], self.config["remove"])
+        if self.config["remove"] and not self._is_disk_cache():
+            # renders cached on disk by an earlier config are no longer read
+            file_handler.rm(f"{self.config['out']}/.cache")
+
+    def _is_disk_cache(self) -> bool:
+        return str(self.config.get("render_cache_disk", "false")).lower() == "true"
+
+    def _wait_for_startup(self) -> None:
+        # raises anything the background clear raised
+        startup, self.startup = self.startup, None
+        if startup is not None:
+            startup.result()
+
+    def close(self) -> None:
+        self.startup_executor.shutdown(wait=False)
+        if self.handler is not None:
+            self.handler.close()
+            self.handler = None
 
     def load_config(self, config: Namespace) -> dict:
+        # a clear still running for the previous config must not interleave with this one
+        self._wait_for_startup()
         self.config = load_base_config(config)
+        TOKEN_CACHE.configure(float(self.config.get("token_refresh_margin", 60)),
+                              float(self.config.get("token_ttl", 900)))
+        if self.handler is not None:
+            self.handler.close()
         self.handler = RequestHandler(self.config["mode"], self.config["core"], self.config["observatory"],
-                                      self.config["username"], self.config["password"])
-        self.config["geometry"] = self.handler.get_geometry()
-        self.config["bounds"] = self.handler.get_bounds()
-        self.config["renderer"] = self.handler.renderer
+                                      self.config["username"], self.config["password"],
+                                      pool_size=int(self.config.get("pool_size", 10)),
+                                      retries=int(self.config.get("retries", 3)),
+                                      backoff=float(self.config.get("backoff", 0.3)))
+        METADATA_CACHE.configure(float(self.config.get("metadata_ttl", 300)))
+        key = (self.config["core"], self.config["observatory"])
+        cached = METADATA_CACHE.get(key)
+        metadata = self.handler.load_metadata(cached)
+        if cached is None:
+            METADATA_CACHE.put(key, metadata)
+        self.config["geometry"] = metadata["geometry"]
+        self.config["bounds"] = metadata["bounds"]
+        self.config["renderer"] = metadata["renderer"]
         self.config["project_id"] = str(uuid.uuid4()).replace("-", "")
-        self.handler.clear_space()
-        FileHandler().load_dir(self.config["out"], self.config["remove"])
+        file_handler = FileHandler()
+        self.asset_store = AssetStore(self.config["out"], file_handler) if self.config["content_addressed"] else None
+        if self.config["background"]:
+            # the next tee waits for the space and output directory to be cleared
+            file_handler.mkdir(self.config["out"])
+            self.startup = self.startup_executor.submit(self._clear, file_handler)
+        else:
+            self._clear(file_handler)
+
+        cache_dir = self.config["out"] if self._is_disk_cache() else None
+        for cache in (LATEX_CACHE, MARKDOWN_CACHE):
+            cache.configure(int(self.config.get("render_cache_size", 256)),
+                            int(self.config.get("render_cache_bytes", 32 * 1024 * 1024)), cache_dir,
+                            int(self.config.get("render_cache_disk_bytes", 256 * 1024 * 1024)))
+        if self.config["downscale"] and not is_resize_available():
+            print("Pillow is not installed, images will not be downscaled")
+            self.config["downscale"] = False
+        if self.config["tiles"] and not is_tiling_available():
+            print("Pillow is not installed, large images will not be tiled")
+            self.config["tiles"] = False
+        configure_render_pool(int(self.config.get("render_workers", 0)), float(self.config.get("render_timeout", 30)))
+
+    def _get_fingerprints(self, cell_config: Namespace, outputs: list[list]) -> list[str]:
+        layout = get_fingerprint(vars(cell_config), len(outputs))
+        return [get_fingerprint(layout, data_type, data, metadata) for _, data_type, data, metadata in outputs]
+
+    def _is_unchanged(self, cell_config: Namespace, output_idx: int, fingerprint: str) -> bool:
+        existing = self.config["sections"].get(f"{cell_config.cell_no}-{output_idx}", None)
+        return existing is not None and existing.get("fingerprint", None) == fingerprint
+
+    def _build_output(self, cell_config: Namespace, geometry: Geometry, asset_handler: AssetHandler,
+                      output_formatter: OutputFormatter, image_resizer: typing.Optional[ImageResizer],
+                      unchanged: set[int], output_idx: int, output: list) -> tuple[str, dict, dict]:
+        idx, data_type, data, metadata = output
+        if output_idx in unchanged:
+            # identical output and layout, the stored section is resent to replace_section which skips it
+            existing = self.config["sections"][f"{cell_config.cell_no}-{output_idx}"]
+            return idx, existing["data"], existing["section"]
+        data_type = DataType(data_type)
+        section_builder = SectionBuilder(self.config["renderer"], asset_handler, output_formatter, image_resizer)
+        layout = section_builder.build_section(data, geometry, self.config["geometry"], cell_config.cell_no,
+                                               output_idx, data_type, metadata, self.config["project_id"])
+        section = section_builder.convert_section(layout, self.config["geometry"], self.config["observatory"],
+                                                  data_type)
+        return idx, layout, section
+
+    def _replace_output(self, cell_config: Namespace, output_idx: int, section: dict) -> typing.Optional[int]:
+        existing = self.config["sections"].get(f"{cell_config.cell_no}-{output_idx}", None)
+        return self.handler.replace_section(section, existing)
+
+    def _tee_serial(self, cell_config: Namespace, geometry: Geometry, asset_handler: AssetHandler,
+                    output_formatter: OutputFormatter, image_resizer: typing.Optional[ImageResizer],
+                    unchanged: set[int], outputs: list[list]) -> typing.Iterator[tuple]:
+        # everything is formatted before the first request so the wall is updated in one burst
+        built = [self._build_output(cell_config, geometry, asset_handler, output_formatter, image_resizer, unchanged,
+                                    output_idx, output) for output_idx, output in enumerate(outputs)]
+        section_ids = self.handler.replace_sections(cell_config.cell_no, [section for _, _, section in built],
+                                                    self.config["sections"])
+        for (idx, layout, section), section_id in zip(built, section_ids):
+            yield idx, layout, section, section_id
+
+    def _tee_pipelined(self, cell_config: Namespace, geometry: Geometry, asset_handler: AssetHandler,
+                       output_formatter: OutputFormatter, image_resizer: typing.Optional[ImageResizer],
+                       unchanged: set[int], outputs: list[list]) -> typing.Iterator[tuple]:
+        # outputs are formatted on one pool while earlier outputs are already being uploaded on the other,
+        # results are collected in submission order so sections are recorded in output order
+        workers = max(1, int(self.config["workers"]))
+        with ThreadPoolExecutor(max_workers=workers) as formatters, ThreadPoolExecutor(max_workers=workers) as uploaders:
+            built = [TEE_STATS.submit(formatters, self._build_output, cell_config, geometry, asset_handler,
+                                      output_formatter, image_resizer, unchanged, output_idx, output)
+                     for output_idx, output in enumerate(outputs)]
+            uploads = []
+            for output_idx, future in enumerate(built):
+                idx, layout, section = future.result()
+                uploads.append((idx, layout, section,
+                                TEE_STATS.submit(uploaders, self._replace_output, cell_config, output_idx, section)))
+            for idx, layout, section, future in uploads:
+                yield idx, layout, section, future.result()
+
+        stale = get_stale_keys(self.config["sections"], cell_config.cell_no, len(outputs))
+        self.handler.delete_sections([self.config["sections"][k]["id"] for k in stale])
 
     def tee(self, cell_config: Namespace, outputs: list[list]) -> list[dict]:
+        with TEE_STATS.tee(cell_config.cell_no):
+            with TEE_STATS.stage("startup"):
+                self._wait_for_startup()
+            controller_urls = self._tee_cell(cell_config, outputs)
+            # totals since the server started, the caches are shared by every handler
+            TEE_STATS.add_counts(render_cache={cache.name: cache.stats() for cache in (LATEX_CACHE, MARKDOWN_CACHE)})
+            TEE_STATS.add_counts(connections=self.handler.get_connection_stats())
+            return controller_urls
+
+    def _tee_cell(self, cell_config: Namespace, outputs: list[list]) -> list[dict]:
         validator = LayoutValidator()
         file_handler = FileHandler()
         out = self.config["out"]
         static = f"{self.config['host']}/ove-jupyter/static"
-        asset_handler = AssetHandler(out, static, file_handler)
+        tiler = TilePyramid(int(self.config.get("tile_threshold", 8192)), int(self.config.get("tile_size", 254)),
+                            workers=int(self.config.get("tile_workers", 0))) if self.config["tiles"] else None
+        asset_handler = AssetHandler(out, static, file_handler, self.asset_store, tiler)
         output_formatter = OutputFormatter(file_handler, asset_handler)
+        image_resizer = ImageResizer(int(self.config.get("downscale_quality", 85)),
+                                     self.config.get("downscale_format", None),
+                                     tmp_dir=out) if self.config["downscale"] else None
 
-        display_type = validator.validate(cell_config)
-        geometry = Geometry(cell_config, display_type, self.config["geometry"], self.config["bounds"], len(outputs))
+        with TEE_STATS.stage("layout"):
+            display_type = validator.validate(cell_config)
+            geometry = Geometry(cell_config, display_type, self.config["geometry"], self.config["bounds"],
+                                len(outputs))
 
-        controller_urls = []
+        with TEE_STATS.stage("fingerprint"):
+            fingerprints = self._get_fingerprints(cell_config, outputs)
+            # local to this tee, the handler is shared by every notebook teeing into the space
+            unchanged = {i for i, fingerprint in enumerate(fingerprints)
+                         if self._is_unchanged(cell_config, i, fingerprint)}
+        stale = get_stale_keys(self.config["sections"], cell_config.cell_no, len(outputs))
+        TEE_STATS.add_counts(sections=len(outputs), skipped=len(unchanged))
+        if self.config["mode"] == Mode.DEVELOPMENT:
+            print(f"Skipped {len(unchanged)}/{len(outputs)} unchanged sections")
 
-        for output_idx, output in enumerate(outputs):
-            idx, data_type, data, metadata = output
-            data_type = DataType(data_type)
-            section_builder = SectionBuilder(self.config["renderer"], asset_handler, output_formatter)
-            layout = section_builder.build_section(data, geometry, self.config["geometry"], cell_config.cell_no,
-                                                   output_idx, data_type, metadata, self.config["project_id"])
-            section = section_builder.convert_section(layout, self.config["geometry"], self.config["observatory"],
-                                                      data_type)
+        controller_urls = []
+        tee = self._tee_pipelined if self.config["pipeline"] else self._tee_serial
 
-            section_id = self.handler.load_section(cell_config.cell_no, output_idx, section, self.config["sections"])
+        for output_idx, (idx, layout, section, section_id) in enumerate(
+                tee(cell_config, geometry, asset_handler, output_formatter, image_resizer, unchanged, outputs)):
+            if section_id is None:
+                section_id = len(self.config["sections"])
             self.config["sections"][f"{cell_config.cell_no}-{output_idx}"] = {
                 "id": section_id,
-                "data": layout
+                "data": layout,
+                "section": section,
+                "fingerprint": fingerprints[output_idx]
             }
 
             if not self.config["multi_controller"]:
                 controller_urls.append(
                     {"idx": idx, "url": f"{section['app']['url']}/control.html?oveSectionId={section_id}"})
 
+        if image_resizer is not None:
+            TEE_STATS.add_counts(image_savings=image_resizer.savings)
+            if self.config["mode"] == Mode.DEVELOPMENT:
+                for saving in image_resizer.savings:
+                    print(f"Downscaled {saving['asset']} to {saving['width']}x{saving['height']} {saving['format']}: "
+                          f"{saving['before']} -> {saving['after']} bytes")
+
+        for k in stale:
+            self.config["sections"].pop(k)
+        if self.asset_store is not None:
+            self.asset_store.release(stale)
+
+        # nothing on the wall changed so the overview and controller are still current
+        if len(unchanged) == len(outputs) and len(stale) == 0:
+            return controller_urls
+
         if self.config["mode"] == Mode.DEVELOPMENT:
-            overview = output_formatter.format_overview(self.config["observatory"],
-                                                        self.config["bounds"],
-                                                        [x["data"] for x in self.config["sections"].values()])
-            file_handler.to_file(overview, filename=f"{self.config['out']}/overview.html", file_mode="w")
+            with TEE_STATS.stage("overview"):
+                overview = output_formatter.format_overview(self.config["observatory"],
+                                                            self.config["bounds"],
+                                                            [x["data"] for x in self.config["sections"].values()])
+                file_handler.to_file(overview, filename=f"{self.config['out']}/overview.html", file_mode="w")
 
         if self.config["multi_controller"]:
-            controller = self.handler.get_controller([v["data"] for v in self.config["sections"].values()],
-                                                     self.config["project_id"])
-            file_handler.to_file(controller, filename=f"{self.config['out']}/control.html", file_mode="w")
+            with TEE_STATS.stage("controller"):
+                controller = self.handler.get_controller([v["data"] for v in self.config["sections"].values()],
+                                                         self.config["project_id"])
+                file_handler.to_file(controller, filename=f"{self.config['out']}/control.html", file_mode="w")
 
         return controller_urls
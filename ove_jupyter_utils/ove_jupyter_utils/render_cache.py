@@ -0,0 +1,131 @@
+import os
+import typing
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+
+class RenderCache:
+    """LRU of rendered LaTeX / Markdown keyed by the input text, optionally backed by files under out/.cache."""
+
+    def __init__(self, name: str, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024):
+        self.name = name
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = self.disk_hits = self.misses = 0
+        self.disk_dir = None
+        self.disk_size = 0
+        self.max_disk_bytes = 0
+        self.configure(max_entries, max_bytes)
+
+    def configure(self, max_entries: int, max_bytes: int, out_dir: typing.Optional[str] = None,
+                  max_disk_bytes: int = 256 * 1024 * 1024) -> None:
+        with self.lock:
+            # entries are keyed by the input text alone, so they stay valid and are only trimmed to the new limits
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._trim()
+            disk_dir = None if out_dir is None else f"{out_dir}/.cache/{self.name}"
+            changed = (disk_dir, max_disk_bytes) != (self.disk_dir, self.max_disk_bytes)
+            self.disk_dir = disk_dir
+            self.max_disk_bytes = max_disk_bytes
+        if disk_dir is not None and changed:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._trim_disk(disk_dir)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _insert(self, key: str, rendered: str) -> None:
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = rendered
+        self.size += len(rendered)
+        self._trim()
+
+    def _trim(self) -> None:
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _trim_disk(self, disk_dir: str) -> None:
+        """Removes the least recently used renders until the directory is below 90% of max_disk_bytes, so the next
+        few puts don't scan it again. Disk hits touch their file."""
+        files = []
+        for name in os.listdir(disk_dir):
+            try:
+                fs = os.stat(f"{disk_dir}/{name}")
+            except FileNotFoundError:
+                continue
+            files.append((fs.st_mtime, fs.st_size, name))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_disk_bytes:
+            for _, size, name in sorted(files):
+                if total <= self.max_disk_bytes * 0.9:
+                    break
+                try:
+                    os.remove(f"{disk_dir}/{name}")
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self.lock:
+            if self.disk_dir == disk_dir:
+                self.disk_size = total
+
+    def get(self, text: str) -> typing.Optional[str]:
+        key = self._key(text)
+        with self.lock:
+            rendered = self.entries.get(key, None)
+            if rendered is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return rendered
+            disk_dir = self.disk_dir
+
+        if disk_dir is not None and os.path.exists(f"{disk_dir}/{key}.html"):
+            try:
+                with open(f"{disk_dir}/{key}.html") as f:
+                    rendered = f.read()
+                os.utime(f"{disk_dir}/{key}.html")
+            except FileNotFoundError:
+                # evicted meanwhile
+                rendered = None
+        if rendered is not None:
+            with self.lock:
+                self._insert(key, rendered)
+                self.disk_hits += 1
+            return rendered
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, rendered: str) -> None:
+        key = self._key(text)
+        with self.lock:
+            self._insert(key, rendered)
+            disk_dir = self.disk_dir
+
+        if disk_dir is not None:
+            # written to a temporary file first so a concurrent reader never sees a partial render
+            fd, tmp = tempfile.mkstemp(dir=disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(rendered)
+            os.replace(tmp, f"{disk_dir}/{key}.html")
+            with self.lock:
+                self.disk_size += os.path.getsize(f"{disk_dir}/{key}.html")
+                full = self.disk_dir == disk_dir and self.disk_size > self.max_disk_bytes
+            if full:
+                self._trim_disk(disk_dir)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+LATEX_CACHE = RenderCache("latex")
+MARKDOWN_CACHE = RenderCache("markdown")
@@ -0,0 +1,96 @@
+import sys
+import typing
+import logging
+import threading
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from .utils import OVEException
+
+LOGGER = logging.getLogger(__name__)
+
+
+def render_latex(latex: str) -> str:
+    from IPython.lib.latextools import latex_to_html
+    return latex_to_html(latex)
+
+
+def render_markdown(md: str) -> str:
+    from markdown import markdown
+    return markdown(md)
+
+
+class RenderPool:
+    """Renders LaTeX / Markdown in worker processes, each worker has its own renderer so no global lock is needed."""
+
+    def __init__(self, workers: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.executor = None
+        self.closed = False
+
+    def _get_executor(self) -> typing.Optional[ProcessPoolExecutor]:
+        with self.lock:
+            # a pool replaced by configure_render_pool is not restarted by renders still holding it
+            if self.executor is None and not self.closed:
+                # spawn avoids forking a kernel that is already running threads
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            return self.executor
+
+    def render(self, fn: typing.Callable[[str], str], text: str) -> typing.Optional[str]:
+        """Returns None if the pool is closed or broken, the caller falls back to rendering locally. A render that
+        times out is not retried, it would block the tee for as long again."""
+        executor = self._get_executor()
+        if executor is None:
+            return None
+        try:
+            return executor.submit(fn, text).result(timeout=self.timeout)
+        except TimeoutError:
+            LOGGER.warning("Render timed out after %ss, stopping the render workers", self.timeout)
+            self._stop(executor, terminate=True)
+            raise OVEException(f"Rendering timed out after {self.timeout}s")
+        except BrokenProcessPool:
+            LOGGER.warning("Render pool broken, restarting")
+            self._stop(executor)
+            return None
+
+    def _stop(self, executor: ProcessPoolExecutor, terminate: bool = False) -> None:
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        # the workers are only stopped after their current render, unless terminated
+        processes = list((getattr(executor, "_processes", None) or {}).values()) if terminate else []
+        if sys.version_info >= (3, 9):
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self) -> None:
+        with self.lock:
+            self.closed = True
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            self._stop(executor)
+
+
+RENDER_POOL: typing.Optional[RenderPool] = None
+
+
+def configure_render_pool(workers: int, timeout: float) -> None:
+    global RENDER_POOL
+    if RENDER_POOL is not None and (RENDER_POOL.workers, RENDER_POOL.timeout) == (workers, timeout):
+        # renders of other handlers may be running on it
+        return
+    if RENDER_POOL is not None:
+        RENDER_POOL.shutdown()
+    RENDER_POOL = RenderPool(workers, timeout) if workers > 0 else None
+
+
+def get_render_pool() -> typing.Optional[RenderPool]:
+    return RENDER_POOL
@@ -1,71 +1,176 @@
 import base64
 import typing
-import uuid
 import json
 
 import requests
 
-from .utils import Mode
-from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .utils import Mode, get_stale_keys
+from .tee_stats import TEE_STATS
+from .token_cache import TOKEN_CACHE
+
+# (connect, read) timeouts in seconds per endpoint
+DEFAULT_TIMEOUTS = {
+    "login": (3.05, 10),
+    "token": (3.05, 10),
+    "renderer": (3.05, 10),
+    "bounds": (3.05, 10),
+    "geometry": (3.05, 10),
+    "section": (3.05, 30),
+    "sections": (3.05, 30),
+    "controller": (3.05, 30)
+}
 
 
 class RequestHandler:
-    def __init__(self, mode: Mode, core: str, observatory: str, username: str, password: str):
+    def __init__(self, mode: Mode, core: str, observatory: str, username: str, password: str, pool_size: int = 10,
+                 retries: int = 3, backoff: float = 0.3, timeouts: typing.Optional[dict] = None):
         self.mode = mode
         self.core = core
         self.observatory = observatory
         self.username = username
         self.password = password
-        self.tokens = self._get_tokens()
-        self.renderer = self._get_renderer()
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts if timeouts is not None else {})}
+        self.session = self._get_session(pool_size, retries, backoff)
+        # login and the renderer lookup are deferred until a request needs them, see load_metadata
+        self.token_key = (core, username)
+        TOKEN_CACHE.acquire(self.token_key, self._get_tokens, self._refresh_tokens)
+        self.renderer = None
+
+    def _get_session(self, pool_size: int, retries: int, backoff: float) -> requests.Session:
+        # POST is not idempotent so it is never retried, GET and DELETE are
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset(["GET", "DELETE"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
-    def _get(self, url: str) -> typing.Any:
-        return requests.get(f"{self.renderer}/{url}").json()
+    def _get(self, url: str, endpoint: str) -> typing.Any:
+        with TEE_STATS.request(endpoint):
+            return self.session.get(f"{self.renderer}/{url}", timeout=self.timeouts[endpoint]).json()
 
-    def _delete(self, url: str) -> None:
+    def _delete(self, url: str, endpoint: str) -> None:
         if self.mode == Mode.PRODUCTION:
-            requests.delete(f"{self.renderer}/{url}")
+            with TEE_STATS.request(endpoint):
+                self.session.delete(f"{self.renderer}/{url}", timeout=self.timeouts[endpoint])
         else:
             print(f"DELETE: {self.renderer}/{url}")
 
+    def _get_core(self, url: str, endpoint: str) -> typing.Any:
+        tokens = self.tokens
+        with TEE_STATS.request(endpoint):
+            response = self.session.get(f"{self.core}/{url}", headers={"Authorization": f"Bearer {tokens['access']}"},
+                                        timeout=self.timeouts[endpoint])
+        if response.status_code == 401:
+            # revoked or expired early, retried once with new tokens
+            tokens = TOKEN_CACHE.invalidate(self.token_key, tokens)
+            with TEE_STATS.request(endpoint):
+                response = self.session.get(f"{self.core}/{url}",
+                                            headers={"Authorization": f"Bearer {tokens['access']}"},
+                                            timeout=self.timeouts[endpoint])
+        return response.json()
+
     def _get_renderer(self):
-        return requests.get(f"{self.core}/core/renderer",
-                            headers={"Authorization": f"Bearer {self.tokens['access']}"}).json()
+        return self._get_core("core/renderer", "renderer")
+
+    @property
+    def tokens(self) -> dict:
+        return TOKEN_CACHE.get(self.token_key)
 
     def _get_tokens(self) -> dict:
         raw = f"{self.username}:{self.password}"
         encoded = base64.b64encode(bytes(raw, "utf-8")).decode("utf-8")
-        return requests.post(f"{self.core}/login",
-                             headers={"Authorization": f"Basic {encoded}"}).json()
+        with TEE_STATS.request("login"):
+            return self.session.post(f"{self.core}/login", headers={"Authorization": f"Basic {encoded}"},
+                                     timeout=self.timeouts["login"]).json()
 
-    def _post(self, url: str, data: typing.Any) -> typing.Optional[typing.Any]:
+    def _refresh_tokens(self, tokens: dict) -> typing.Optional[dict]:
+        # None falls back to logging in again
+        if "refresh" not in tokens:
+            return None
+        with TEE_STATS.request("token"):
+            response = self.session.post(f"{self.core}/token", headers={"Authorization": f"Bearer {tokens['refresh']}"},
+                                         timeout=self.timeouts["token"])
+        if response.status_code != 200:
+            return None
+        return {**tokens, **response.json()}
+
+    def _post(self, url: str, data: typing.Any, endpoint: str) -> typing.Optional[typing.Any]:
         if self.mode == Mode.PRODUCTION:
-            return requests.post(f"{self.renderer}/{url}", json=data,
-                                 headers={"Content-Type": "application/json"}).json()
+            with TEE_STATS.request(endpoint):
+                return self.session.post(f"{self.renderer}/{url}", json=data,
+                                         headers={"Content-Type": "application/json"},
+                                         timeout=self.timeouts[endpoint]).json()
         else:
             print(f"POST: {self.renderer}/{url} - {data}")
             return None
 
-    def load_section(self, cell_no: int, i: int, section: dict, sections: list[dict]) -> int:
-        section_id = sections.get(f"{cell_no}-{i}", None)
-        if section_id is not None:
-            self._delete(f"sections/{section_id['id']}")
+    def get_connection_stats(self) -> dict:
+        # urllib3 counts new connections and requests per pool, anything above one request per connection is reuse
+        stats = {"requests": 0, "connections": 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+        stats["reused"] = stats["requests"] - stats["connections"]
+        return stats
+
+    def replace_section(self, section: dict, existing: typing.Optional[dict]) -> typing.Optional[int]:
+        if existing is None:
+            section_id = self._post("section", section, "section")
+            return None if section_id is None else section_id["id"]
+
+        # unchanged geometry and asset url, nothing to send
+        if existing.get("section", None) == section:
+            return existing["id"]
+
+        # update in place so the old section stays visible until the new one is ready
+        self._post(f"sections/{existing['id']}", section, "sections")
+        return existing["id"]
 
-        section_id = self._post("section", section)
-        return len(sections) if section_id is None else section_id["id"]
+    def delete_sections(self, section_ids: list[int]) -> None:
+        for section_id in section_ids:
+            self._delete(f"sections/{section_id}", "sections")
+
+    def replace_sections(self, cell_no: int, sections: list[dict], existing: dict) -> list[typing.Optional[int]]:
+        section_ids = [self.replace_section(section, existing.get(f"{cell_no}-{i}", None))
+                       for i, section in enumerate(sections)]
+        self.delete_sections([existing[k]["id"] for k in get_stale_keys(existing, cell_no, len(sections))])
+        return section_ids
 
     def get_geometry(self) -> dict:
-        geometry = self._get(f"spaces/{self.observatory}/geometry")
+        geometry = self._get(f"spaces/{self.observatory}/geometry", "geometry")
         return geometry
 
     def clear_space(self) -> None:
-        self._delete(f"sections?space={self.observatory}")
+        self._delete(f"sections?space={self.observatory}", "sections")
 
     def get_bounds(self):
-        return requests.get(f"{self.core}/core/observatories/bounds",
-                            headers={"Authorization": f"Bearer {self.tokens['access']}"}).json()[self.observatory]
+        return self._get_core("core/observatories/bounds", "bounds")[self.observatory]
+
+    def load_metadata(self, metadata: typing.Optional[dict] = None) -> dict:
+        """Renderer url, geometry and bounds, fetched unless a cached copy is passed in."""
+        if metadata is None:
+            # the bounds only need the login and the geometry needs the renderer, so the two chains run side by side
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                bounds = executor.submit(self.get_bounds)
+                self.renderer = self._get_renderer()
+                metadata = {"renderer": self.renderer, "geometry": self.get_geometry(), "bounds": bounds.result()}
+        self.renderer = metadata["renderer"]
+        return metadata
 
     def get_controller(self, sections: list[dict], project_id: str) -> str:
-        return requests.get(
-            f"{self.core}/project/{project_id}/control?observatory={self.observatory}&layout={json.dumps(sections)}",
-            headers={"Authorization": f"Bearer {self.tokens['access']}"}).json()
+        return self._get_core(f"project/{project_id}/control?observatory={self.observatory}&layout={json.dumps(sections)}",
+                              "controller")
+
+    def close(self) -> None:
+        TOKEN_CACHE.release(self.token_key)
+        self.session.close()
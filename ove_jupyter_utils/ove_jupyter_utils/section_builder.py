@@ -2,27 +2,32 @@ import typing
 import uuid
 
 from .ove_app import OVEApp
+from .tee_stats import TEE_STATS
 from .geometry import Geometry
 from .data_type import DataType
 from .asset_handler import AssetHandler
+from .image_resizer import ImageResizer
 from .output_formatter import OutputFormatter
 
 
 class SectionBuilder:
-    def __init__(self, renderer: str, asset_handler: AssetHandler, output_formatter: OutputFormatter):
+    def __init__(self, renderer: str, asset_handler: AssetHandler, output_formatter: OutputFormatter,
+                 image_resizer: typing.Optional[ImageResizer] = None):
         self.asset_handler = asset_handler
         self.renderer = renderer
         self.formatter = output_formatter
+        self.image_resizer = image_resizer
 
     def convert_section(self, data: dict, canvas: dict, space: str, data_type: DataType) -> dict:
         app = OVEApp.from_data_type(data_type)
+        # the images app opens tile pyramids with OpenSeadragon
+        load = {"tileSources": data["asset"]} if data["asset"].split("?", 1)[0].endswith(".dzi") \
+            else {"url": data["asset"]}
 
         return {
             "app": {
                 "states": {
-                    "load": {
-                        "url": data["asset"]
-                    }
+                    "load": load
                 },
                 "url": f"{self.renderer}/app/{app.value}"
             },
@@ -34,8 +39,15 @@ class SectionBuilder:
         }
 
     def build_section(self, data: str, geometry: Geometry, canvas: dict, cell_no: int, i: int, data_type: DataType, metadata: dict, project_id: str) -> dict:
-        data = self.formatter.format_data(data, data_type, metadata)
-        asset_filename = self.asset_handler.write_asset(data, cell_no, i, data_type)
+        with TEE_STATS.stage("format"):
+            data = self.formatter.format_data(data, data_type, metadata)
+        # tiled images keep their full resolution
+        if self.image_resizer is not None and not self.asset_handler.is_tiled(data, data_type):
+            with TEE_STATS.stage("resize"):
+                data, data_type = self.image_resizer.resize(data, data_type, geometry.widths[i] * canvas["w"],
+                                                            geometry.heights[i] * canvas["h"], f"{cell_no}-{i}")
+        with TEE_STATS.stage("write_asset"):
+            asset_filename = self.asset_handler.write_asset(data, cell_no, i, data_type)
         asset_url = self.asset_handler.get_asset_url(asset_filename)
         return {
             "id": str(uuid.uuid4()).replace("-", ""),
@@ -1,4 +1,6 @@
 import io
+import os
+import functools
 import json
 import sys
 import traceback
@@ -9,6 +11,9 @@ from traceback import format_exc
 from .ove_handler import OVEHandler
 from http.server import SimpleHTTPRequestHandler
 from .file_server import BaseHandler, ThreadedHTTPServer
+from .server_log import SERVER_LOG, SERVER_LOGGER
+from .tee_stats import TEE_STATS
+from .multipart import UPLOAD_DIR, get_boundary, read_multipart
 
 
 class Server(BaseHandler):
@@ -37,7 +42,7 @@ class Server(BaseHandler):
         self.send_header("Content-type", f"{content_type}; charset=%s" % enc)
         self.send_header("Content-Length", str(len(encoded)))
         self.end_headers()
-        SimpleHTTPRequestHandler.copyfile(self, f, self.wfile)
+        self.copyfile(f, self.wfile)
         f.close()
 
     def _send_json(self, data: typing.Any) -> None:
@@ -46,58 +51,94 @@ class Server(BaseHandler):
     def do_GET(self) -> None:
         if not self.is_authorized():
             self.send_unauthorised()
-        elif self.path == "/mode":
-            self._send_json({"mode": self.handler.config['mode'].value})
+            return
+        result = dispatch(self.handler, "GET", self.path)
+        if result is None:
+            BaseHandler.do_GET(self)
         else:
-            SimpleHTTPRequestHandler.do_GET(self)
+            self._send_result(*result)
 
     def do_OPTIONS(self) -> None:
         self._send_code(200)
 
     def do_POST(self) -> None:
         try:
+            boundary = get_boundary(self.headers.get("Content-Type"))
             if not self.is_authorized():
                 self.send_unauthorised()
-            elif self.path == "/config":
-                data = self._load_and_decode()
-                uuid, args = data["id"], data["data"]
-                if type(args) == str:
-                    args = self.handler.parse_config(args)
-                else:
-                    args = argparse.Namespace(**args)
-
-                self.handler.ove_config(uuid, args)
-                self._send_code(200)
-            elif self.path == "/tee":
-                data = self._load_and_decode()
-                uuid, args = data["id"], data["data"]
-                if type(args) == str:
-                    args = self.handler.parse_tee(args)
-                else:
-                    args = argparse.Namespace(**args)
-
-                self.handler.tee(uuid, args)
-                self._send_code(200)
-            elif self.path == "/output":
-                data = self._load_and_decode()
-                uuid, outputs, cell_no = data["id"], data["data"], data["cell_no"]
-                urls = self.handler.handle_output(uuid, outputs, cell_no)
-                self._send_json(urls)
-            elif self.path == "/controller":
-                uuid = self._load_and_decode()["id"]
-                self.handler.config[uuid]["multi_controller"] = True
-                self._send_code(200)
+            elif boundary is not None:
+                # binary outputs are streamed to files instead of arriving as base64 in one JSON document
+                parser = read_multipart(self.rfile, int(self.headers.get("Content-Length")), boundary,
+                                        os.path.join(self.directory, UPLOAD_DIR))
+                try:
+                    self._send_result(*dispatch(self.handler, "POST", self.path, parser.get_data()))
+                finally:
+                    parser.remove_uploads()
             else:
-                self._send_code(404)
+                self._send_result(*dispatch(self.handler, "POST", self.path, self._load_and_decode()))
         except Exception as e:
-            print(e)
-            print(format_exc())
+            if self.is_background:
+                SERVER_LOGGER.exception("%s %s failed", self.command, self.path)
+            else:
+                print(e)
+                print(format_exc())
             self._send_data(str(e), code=500)
 
-
-def create_server(port, out, config, is_background):
+    def _send_result(self, code: int, data: typing.Any) -> None:
+        if data is None:
+            self._send_code(code)
+        else:
+            self._send_json(data)
+
+
+def get_cell_config(config: dict) -> argparse.Namespace:
+    # same renaming as the notebook extension, from and to are keywords
+    config = dict(config)
+    config["from_"] = config.pop("from", None)
+    config["to_"] = config.pop("to", None)
+    return argparse.Namespace(**config)
+
+
+def dispatch(handler: OVEHandler, method: str, path: str, data: typing.Any = None) -> typing.Optional[tuple]:
+    """ Runs an endpoint against the handler, shared by the threaded and asyncio servers.
+    Returns the status code and the JSON response (None for an empty one), or None if a GET
+    is not an endpoint and should be served as a static file.
+    """
+    path = path.split("?", 1)[0]
+    if method == "GET":
+        if path == "/mode":
+            return 200, {"mode": handler.config["mode"].value}
+        elif path == "/stats":
+            return 200, TEE_STATS.get_stats()
+        elif path == "/stats/trace":
+            return 200, TEE_STATS.get_trace()
+        return None
+
+    if path == "/config":
+        handler.load_config(argparse.Namespace(**data))
+        return 200, None
+    elif path == "/tee" or path == "/output":
+        sections = handler.tee(get_cell_config(data["config"]), data["outputs"])
+        return 200, sections if path == "/output" else None
+    elif path == "/controller":
+        handler.config["multi_controller"] = True
+        return 200, None
+    return 404, None
+
+
+def create_server(port, out, config, is_background, server_mode="threaded", max_connections=256, workers=4):
+    if server_mode == "async":
+        from .async_server import AsyncServer
+        AsyncServer(out, config, is_background, dispatch=functools.partial(dispatch, OVEHandler()),
+                    max_connections=max_connections, workers=workers).serve_forever(port)
+        return
     server = ThreadedHTTPServer(("", port), handler_from(out, is_background, config))
-    server.serve_forever()
+    if is_background:
+        SERVER_LOG.start(out, config)
+    try:
+        server.serve_forever()
+    finally:
+        SERVER_LOG.stop()
 
 
 def handler_from(directory, is_background, config):
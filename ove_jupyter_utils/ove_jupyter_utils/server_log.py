@@ -0,0 +1,79 @@
+import json
+import time
+import queue
+import typing
+import logging
+import logging.handlers
+
+from dotenv import dotenv_values
+
+SERVER_LOGGER = logging.getLogger("ove.server")
+ACCESS_LOGGER = logging.getLogger("ove.server.access")
+
+
+class ServerLog:
+    """ Background file server logging, started once with the server.
+
+    Request threads only put records on a queue, a listener thread writes them to
+    server.log (messages and errors) and access.log (one JSON object per request),
+    both rotated by size.
+    """
+
+    def __init__(self):
+        self.log_headers = False
+        self.queue_handler = None
+        self.listener = None
+
+    @staticmethod
+    def _get_file_handler(filename: str, formatter: logging.Formatter, is_access: bool, max_bytes: int,
+                          backups: int) -> logging.Handler:
+        handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups, delay=True)
+        handler.setFormatter(formatter)
+        handler.addFilter(lambda record: (record.name == ACCESS_LOGGER.name) == is_access)
+        return handler
+
+    def start(self, directory: str, config: str) -> None:
+        """ Reads OVE_LOG_LEVEL, OVE_LOG_HEADERS, OVE_LOG_MAX_BYTES and OVE_LOG_BACKUPS from the env file. """
+        self.stop()
+        config = {k[4:].lower(): v for k, v in dotenv_values(config).items() if "OVE_" == k[:4]}
+        max_bytes = int(config.get("log_max_bytes", 10 * 1024 * 1024))
+        backups = int(config.get("log_backups", 5))
+        self.log_headers = str(config.get("log_headers", "false")).lower() == "true"
+
+        server = self._get_file_handler(f"{directory}/server.log", logging.Formatter(
+            "%(asctime)s,%(msecs)d %(name)s %(levelname)s %(thread)d %(message)s", datefmt="%H:%M:%S"),
+                                        False, max_bytes, backups)
+        access = self._get_file_handler(f"{directory}/access.log", logging.Formatter("%(message)s"), True,
+                                        max_bytes, backups)
+        log_queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(log_queue, server, access)
+        self.queue_handler = logging.handlers.QueueHandler(log_queue)
+        SERVER_LOGGER.addHandler(self.queue_handler)
+        SERVER_LOGGER.setLevel(config.get("log_level", "INFO").upper())
+        SERVER_LOGGER.propagate = False
+        self.listener.start()
+
+    def stop(self) -> None:
+        if self.listener is None:
+            return
+        SERVER_LOGGER.removeHandler(self.queue_handler)
+        # writes out whatever is still queued
+        self.listener.stop()
+        self.listener = None
+        self.queue_handler = None
+
+    def log_access(self, client: str, method: str, path: str, code: typing.Optional[int], bytes_sent: int,
+                   start: float, headers: typing.Any) -> None:
+        """ Structured access line, start is the time.perf_counter() the request was read at. """
+        if not ACCESS_LOGGER.isEnabledFor(logging.INFO):
+            return
+        line = {"time": round(time.time(), 3), "client": client, "method": method, "path": path, "status": code,
+                "bytes": bytes_sent, "ms": round((time.perf_counter() - start) * 1000, 3)}
+        if headers is not None and headers.get("Range") is not None:
+            line["range"] = headers.get("Range")
+        if headers is not None and self.log_headers:
+            line["headers"] = dict(headers.items())
+        ACCESS_LOGGER.info(json.dumps(line))
+
+
+SERVER_LOG = ServerLog()
@@ -0,0 +1,221 @@
+import re
+import json
+import time
+import base64
+import random
+import typing
+import argparse
+import threading
+
+from collections import Counter
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """ Minimal stand-in for OVE core and renderer so the handler can be load tested offline.
+
+    Every request waits latency seconds plus up to jitter seconds. A failure_rate share of the
+    requests to failure_routes (all routes if None) is answered with failure_status, or has its
+    connection dropped without a response if failure_status is 0. Every request is counted in
+    requests by route, e.g. "POST /sections/{id}".
+
+    Core requests need an access token from /login or /token, which expires after token_ttl seconds
+    and is answered with 401 afterwards.
+    """
+
+    def __init__(self, observatory: str = "do", latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                 failure_status: int = 503, failure_routes: typing.Optional[list[str]] = None, columns: int = 4,
+                 rows: int = 2, width: int = 7680, height: int = 2160, host: str = "127.0.0.1", port: int = 0,
+                 seed: typing.Optional[int] = None, token_ttl: float = 3600):
+        self.observatory = observatory
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.failure_routes = None if failure_routes is None else set(failure_routes)
+        self.bounds = {observatory: {"columns": columns, "rows": rows}}
+        self.geometry = {"w": width, "h": height}
+        self.requests = Counter()
+        self.failures = Counter()
+        self.sections = {}
+        self.random = random.Random(seed)
+        self._next_id = 0
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def __enter__(self) -> "StubServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.failures.clear()
+
+    def _create(self, section: dict) -> int:
+        with self._lock:
+            section_id = self._next_id
+            self._next_id += 1
+            self.sections[section_id] = section
+            return section_id
+
+    def _issue_tokens(self) -> dict:
+        with self._lock:
+            expires = time.time() + self.token_ttl
+            payload = base64.urlsafe_b64encode(json.dumps({"exp": expires, "n": len(self.tokens)}).encode("utf-8"))
+            access = f"e30.{payload.decode('ascii').rstrip('=')}.stub"
+            self.tokens[access] = expires
+            return {"access": access, "refresh": f"refresh-{access}"}
+
+    def revoke_tokens(self) -> None:
+        with self._lock:
+            self.tokens.clear()
+
+    def _is_authorized(self, authorization: typing.Optional[str]) -> bool:
+        access = (authorization or "")[len("Bearer "):]
+        with self._lock:
+            return self.tokens.get(access, 0) > time.time()
+
+    def _should_fail(self, route: str) -> bool:
+        if self.failure_rate <= 0 or (self.failure_routes is not None and route not in self.failure_routes):
+            return False
+        with self._lock:
+            return self.random.random() < self.failure_rate
+
+    def _get_delay(self) -> float:
+        if self.jitter <= 0:
+            return self.latency
+        with self._lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def _route(self, method: str, path: str, body: bytes, authorization: typing.Optional[str]) -> tuple[int, typing.Any]:
+        if method == "POST" and path == "/login":
+            return 200, self._issue_tokens()
+        elif method == "POST" and path == "/token":
+            refresh = (authorization or "")[len("Bearer refresh-"):]
+            with self._lock:
+                known = refresh in self.tokens
+            return (200, {"access": self._issue_tokens()["access"]}) if known else (401, {"error": "invalid token"})
+        elif (path.startswith("/core/") or path.startswith("/project/")) and not self._is_authorized(authorization):
+            return 401, {"error": "invalid token"}
+        elif method == "GET" and path == "/core/renderer":
+            return 200, self.url
+        elif method == "GET" and path == "/core/observatories/bounds":
+            return 200, self.bounds
+        elif method == "GET" and re.match(r"^/spaces/[^/]+/geometry$", path):
+            return 200, self.geometry
+        elif method == "GET" and re.match(r"^/project/[^/]+/control$", path):
+            return 200, "<html></html>"
+        elif method == "POST" and path == "/section":
+            return 200, {"id": self._create(json.loads(body))}
+        elif method == "POST" and re.match(r"^/sections/\d+$", path):
+            section_id = int(path.split("/")[-1])
+            with self._lock:
+                self.sections[section_id] = json.loads(body)
+            return 200, {"id": section_id}
+        elif method == "DELETE" and re.match(r"^/sections/\d+$", path):
+            with self._lock:
+                self.sections.pop(int(path.split("/")[-1]), None)
+            return 200, {}
+        elif method == "DELETE" and path == "/sections":
+            with self._lock:
+                self.sections.clear()
+            return 200, {}
+        return 404, {"error": "not found"}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _send(self, code: int, data: typing.Any) -> None:
+                encoded = json.dumps(data).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def _handle(self, method: str) -> None:
+                path = urlparse(self.path).path
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length > 0 else b""
+                route = f"{method} " + re.sub(r"/\d+$", "/{id}", path)
+                with stub._lock:
+                    stub.requests[route] += 1
+                delay = stub._get_delay()
+                if delay > 0:
+                    time.sleep(delay)
+
+                if stub._should_fail(route):
+                    with stub._lock:
+                        stub.failures[route] += 1
+                    if stub.failure_status == 0:
+                        self.close_connection = True
+                        return
+                    self._send(stub.failure_status, {"error": "injected failure"})
+                    return
+                self._send(*stub._route(method, path, body, self.headers.get("Authorization", None)))
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Stub OVE core and renderer for offline testing")
+    parser.add_argument("-p", "--port", default=8080, type=int, nargs="?")
+    parser.add_argument("--host", default="127.0.0.1", type=str, nargs="?")
+    parser.add_argument("-os", "--observatory", default="do", type=str, nargs="?")
+    parser.add_argument("-c", "--columns", default=4, type=int, nargs="?")
+    parser.add_argument("-r", "--rows", default=2, type=int, nargs="?")
+    parser.add_argument("-l", "--latency", default=0.0, type=float, nargs="?", help="seconds added to every request")
+    parser.add_argument("-j", "--jitter", default=0.0, type=float, nargs="?", help="up to this many more seconds")
+    parser.add_argument("-f", "--failure-rate", default=0.0, type=float, nargs="?", help="share of failed requests")
+    parser.add_argument("-s", "--failure-status", default=503, type=int, nargs="?",
+                        help="status of a failed request, 0 drops the connection")
+    parser.add_argument("--failure-routes", default=None, type=str, nargs="*", help='e.g. "POST /section"')
+    parser.add_argument("--seed", default=None, type=int, nargs="?")
+    parser.add_argument("--token-ttl", default=3600, type=float, nargs="?", help="seconds an access token is valid")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    stub = StubServer(args.observatory, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                      failure_status=args.failure_status, failure_routes=args.failure_routes, columns=args.columns,
+                      rows=args.rows, host=args.host, port=args.port, seed=args.seed,
+                      token_ttl=args.token_ttl)
+    print(f"Stub OVE core and renderer on {stub.url}, set OVE_CORE={stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import typing
+import threading
+import contextlib
+import contextvars
+
+from collections import Counter, deque
+
+
+class TeeRecord:
+    """ Wall time per stage, bytes written and requests made for one tee.
+    Pipelined stages overlap, so their times can add up to more than total_ms.
+    """
+    max_spans = 10000
+
+    def __init__(self, cell_no: int):
+        self.cell_no = cell_no
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.total_ms = None
+        self.stages = {}
+        self.bytes_written = 0
+        self.requests = Counter()
+        self.counts = {}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_stage(self, name: str, start: float, end: float) -> None:
+        with self.lock:
+            stage = self.stages.setdefault(name, {"ms": 0.0, "calls": 0})
+            stage["ms"] += (end - start) * 1000
+            stage["calls"] += 1
+            if len(self.spans) < self.max_spans:
+                self.spans.append((name, start - self.origin, end - start, threading.get_ident()))
+
+    def add_bytes(self, n: int) -> None:
+        with self.lock:
+            self.bytes_written += n
+
+    def add_request(self, endpoint: str) -> None:
+        with self.lock:
+            self.requests[endpoint] += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "cell_no": self.cell_no,
+                "started": self.started,
+                "total_ms": self.total_ms,
+                "stages": {k: {"ms": round(v["ms"], 3), "calls": v["calls"]} for k, v in self.stages.items()},
+                "bytes_written": self.bytes_written,
+                "requests": dict(self.requests),
+                **self.counts
+            }
+
+
+class TeeStats:
+    """ Records the last tees. Each tee has its own record, stages are attributed to the tee whose context they run in.
+    Worker threads don't inherit the context, work for a tee is submitted to them with submit.
+    """
+
+    def __init__(self, history: int = 50):
+        self.history = deque(maxlen=history)
+        self.record = contextvars.ContextVar("tee_record", default=None)
+        self.lock = threading.Lock()
+
+    @property
+    def current(self) -> typing.Optional[TeeRecord]:
+        return self.record.get()
+
+    @contextlib.contextmanager
+    def tee(self, cell_no: int) -> typing.Iterator[TeeRecord]:
+        # the magic and the handler both open a tee, the inner one joins the outer record
+        record = self.current
+        if record is not None:
+            yield record
+            return
+        record = TeeRecord(cell_no)
+        token = self.record.set(record)
+        try:
+            yield record
+        finally:
+            self.record.reset(token)
+            record.total_ms = round((time.perf_counter() - record.origin) * 1000, 3)
+            with self.lock:
+                self.history.append(record)
+
+    def submit(self, executor: typing.Any, fn: typing.Callable, *args) -> typing.Any:
+        """ executor.submit, with fn run in a copy of the caller's context so its stages count towards the same tee. """
+        return executor.submit(contextvars.copy_context().run, fn, *args)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> typing.Iterator[None]:
+        record = self.current
+        if record is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record.add_stage(name, start, time.perf_counter())
+
+    @contextlib.contextmanager
+    def request(self, endpoint: str) -> typing.Iterator[None]:
+        record = self.current
+        if record is not None:
+            record.add_request(endpoint)
+        with self.stage("request"):
+            yield
+
+    def add_bytes(self, n: int) -> None:
+        record = self.current
+        if record is not None:
+            record.add_bytes(n)
+
+    def add_counts(self, **counts) -> None:
+        record = self.current
+        if record is not None:
+            with record.lock:
+                record.counts.update(counts)
+
+    def get_stats(self, last: typing.Optional[int] = None) -> dict:
+        records = list(self.history)[-last:] if last is not None else list(self.history)
+        tees = [record.to_dict() for record in records]
+        totals = {}
+        for tee in tees:
+            for name, stage in tee["stages"].items():
+                total = totals.setdefault(name, {"ms": 0.0, "calls": 0})
+                total["ms"] = round(total["ms"] + stage["ms"], 3)
+                total["calls"] += stage["calls"]
+        return {"tees": tees, "totals": totals}
+
+    def get_trace(self, last: typing.Optional[int] = None) -> dict:
+        """ Chrome trace event format, opens in chrome://tracing and Perfetto. """
+        records = list(self.history)[-last:] if last is not None else list(self.history)
+        events = []
+        for record in records:
+            origin = record.started * 1e6
+            events.append({"name": f"tee {record.cell_no}", "cat": "tee", "ph": "X", "ts": origin,
+                           "dur": (record.total_ms or 0) * 1000, "pid": os.getpid(), "tid": 0,
+                           "args": record.to_dict()})
+            for name, start, duration, tid in record.spans:
+                events.append({"name": name, "cat": "stage", "ph": "X", "ts": origin + start * 1e6,
+                               "dur": duration * 1e6, "pid": os.getpid(), "tid": tid,
+                               "args": {"cell_no": record.cell_no}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_trace(self, filename: str, last: typing.Optional[int] = None) -> None:
+        with open(filename, "w") as f:
+            json.dump(self.get_trace(last), f)
+
+    def clear(self) -> None:
+        self.history.clear()
+
+
+TEE_STATS = TeeStats()
@@ -0,0 +1,42 @@
+import os
+import re
+import threading
+
+from .file_handler import FileHandler
+
+PLACEHOLDER = re.compile(r"%%(\w+)%%")
+
+
+class Template:
+    def __init__(self, text: str, mtime: int):
+        # literal text at even indices, placeholder names at odd indices
+        self.parts = PLACEHOLDER.split(text)
+        self.mtime = mtime
+
+    def substitute(self, **values: str) -> str:
+        parts = list(self.parts)
+        parts[1::2] = [values[name] for name in self.parts[1::2]]
+        return "".join(parts)
+
+
+class TemplateCache:
+    def __init__(self, file_handler: FileHandler):
+        self.file_handler = file_handler
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def get(self, filename: str) -> Template:
+        mtime = os.stat(filename).st_mtime_ns
+        template = self.templates.get(filename, None)
+        if template is not None and template.mtime == mtime:
+            return template
+
+        with self.lock:
+            template = self.templates.get(filename, None)
+            if template is None or template.mtime != mtime:
+                template = Template(self.file_handler.read_file(filename), mtime)
+                self.templates[filename] = template
+            return template
+
+
+TEMPLATE_CACHE = TemplateCache(FileHandler())
@@ -0,0 +1,146 @@
+import io
+import os
+import re
+import math
+import shutil
+import typing
+import tempfile
+import contextlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .locks import PILLOW_LIMIT_LOCK
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# pyramids are named after their content, cell-{cell_no}-{i}-{sha256[:12]} or the asset store's full sha256
+PYRAMID_NAME = r"(?:[0-9a-f]{64}|cell-\d+-\d+-[0-9a-f]{12})"
+DZI = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" Overlap="{overlap}" Format="{format}">
+    <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+
+def is_tiling_available() -> bool:
+    return Image is not None
+
+
+def is_tile(path: str) -> bool:
+    """A pyramid descriptor or one of its tiles, which never change under the same name."""
+    return re.search(rf"(?:^|/){PYRAMID_NAME}(?:\.dzi|_files/\d+/\d+_\d+\.\w+)$", path.split("?", 1)[0]) is not None
+
+
+def get_files_dir(dzi: str) -> str:
+    return f"{dzi[:-len('.dzi')]}_files"
+
+
+@contextlib.contextmanager
+def allow_pixels(max_pixels: int) -> typing.Iterator[None]:
+    """Raises Pillow's decompression bomb limit, for gigapixel outputs, only while an image is opened. The limit is
+    checked by Image.open, so user code and the resizer keep the default."""
+    with PILLOW_LIMIT_LOCK:
+        previous = Image.MAX_IMAGE_PIXELS
+        if previous is not None and previous < max_pixels:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = previous
+
+
+def get_image_size(header: bytes, max_pixels: int) -> typing.Optional[tuple[int, int]]:
+    """Width and height from the start of a PNG / JPEG, Pillow only reads the header when opening."""
+    try:
+        with allow_pixels(max_pixels), Image.open(io.BytesIO(header)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+class TilePyramid:
+    """Deep Zoom (DZI) tile pyramid for images too large to send to every browser whole.
+
+    Level n is the image halved (max_level - n) times, each level is cut into tile_size squares overlapping their
+    neighbours by overlap pixels. Pillow releases the GIL while resizing and encoding, so tiles are written by a
+    thread pool across all cores.
+    """
+
+    def __init__(self, threshold: int = 8192, tile_size: int = 254, overlap: int = 1, workers: int = 0,
+                 max_pixels: int = 2 ** 32):
+        self.threshold = threshold
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.max_pixels = max_pixels
+
+    def is_large(self, size: typing.Optional[tuple[int, int]]) -> bool:
+        return size is not None and max(size) > self.threshold
+
+    def _save_tile(self, level: typing.Any, col: int, row: int, filename: str, image_format: str) -> int:
+        ts, overlap = self.tile_size, self.overlap
+        box = (max(0, col * ts - overlap), max(0, row * ts - overlap),
+               min(level.width, (col + 1) * ts + overlap), min(level.height, (row + 1) * ts + overlap))
+        tile = level.crop(box)
+        if image_format == "jpeg":
+            tile.save(filename, "JPEG", quality=90)
+        else:
+            tile.save(filename, "PNG", compress_level=6)
+        return os.path.getsize(filename)
+
+    def _write(self, source: str, out_dir: str, name: str) -> int:
+        with allow_pixels(self.max_pixels):
+            image = Image.open(source)
+        image_format = "jpeg" if image.format == "JPEG" else "png"
+        mode = "RGB" if image_format == "jpeg" else ("RGBA" if "A" in image.getbands() else "RGB")
+        # loaded before the tiles are cropped concurrently, only one level is held at a time
+        level = image if image.mode == mode else image.convert(mode)
+        level.load()
+        del image
+        width, height = level.size
+        max_level = math.ceil(math.log2(max(width, height)))
+        files_dir = f"{out_dir}/{name}_files"
+
+        written = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for n in range(max_level, -1, -1):
+                if n < max_level:
+                    level = level.resize((max(1, math.ceil(level.width / 2)), max(1, math.ceil(level.height / 2))),
+                                         Image.LANCZOS)
+                os.makedirs(f"{files_dir}/{n}")
+                futures = [executor.submit(self._save_tile, level, col, row,
+                                           f"{files_dir}/{n}/{col}_{row}.{image_format}", image_format)
+                           for col in range(math.ceil(level.width / self.tile_size))
+                           for row in range(math.ceil(level.height / self.tile_size))]
+                # drained before the next level so no queued tile keeps a larger level alive
+                written += sum(future.result() for future in futures)
+        level.close()
+
+        # written last, its existence means the pyramid is complete
+        dzi = DZI.format(tile_size=self.tile_size, overlap=self.overlap, format=image_format, width=width,
+                         height=height)
+        with open(f"{out_dir}/{name}.dzi", "w") as f:
+            f.write(dzi)
+        return written + len(dzi)
+
+    def write(self, source: str, out_dir: str, name: str) -> int:
+        """Writes out_dir/name.dzi and out_dir/name_files, returns the bytes written.
+
+        The pyramid is built in a temporary directory and moved into place, so a reader never sees a partial one.
+        """
+        tmp = tempfile.mkdtemp(dir=out_dir, prefix=".tiles")
+        try:
+            written = self._write(source, tmp, name)
+            if os.path.exists(f"{out_dir}/{name}.dzi"):
+                # identical content was tiled meanwhile
+                return 0
+            if os.path.exists(f"{out_dir}/{name}_files"):
+                shutil.rmtree(f"{out_dir}/{name}_files")
+            os.replace(f"{tmp}/{name}_files", f"{out_dir}/{name}_files")
+            os.replace(f"{tmp}/{name}.dzi", f"{out_dir}/{name}.dzi")
+            return written
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
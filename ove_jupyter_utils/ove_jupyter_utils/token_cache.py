@@ -0,0 +1,134 @@
+import json
+import time
+import base64
+import typing
+import threading
+
+
+def get_expiry(token: str) -> typing.Optional[float]:
+    """exp claim of a JWT access token. The signature is not checked, the token is only ever sent back to OVE."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+class TokenEntry:
+    def __init__(self):
+        self.tokens = None
+        self.expires = 0.0
+        self.refresh_at = 0.0
+        self.users = 0
+        self.timer = None
+        self.login = None
+        self.refresh = None
+        self.lock = threading.Lock()
+
+
+class TokenCache:
+    """OVE core tokens shared by every RequestHandler in the process, keyed by (core, username).
+
+    Tokens are refreshed on a timer margin seconds before they expire while any handler uses them, so requests never
+    wait for a login. Tokens without an exp claim are treated as valid for ttl seconds.
+    """
+
+    def __init__(self, margin: float = 60, ttl: float = 900):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.margin = margin
+        self.ttl = ttl
+
+    def configure(self, margin: float, ttl: float) -> None:
+        with self.lock:
+            self.margin = margin
+            self.ttl = ttl
+
+    def _get_entry(self, key: tuple) -> TokenEntry:
+        with self.lock:
+            return self.entries.setdefault(key, TokenEntry())
+
+    def acquire(self, key: tuple, login: typing.Callable[[], dict],
+                refresh: typing.Callable[[dict], dict]) -> None:
+        """login fetches new tokens, refresh exchanges the current ones. The latest handler's are used."""
+        entry = self._get_entry(key)
+        with entry.lock:
+            entry.users += 1
+            entry.login = login
+            entry.refresh = refresh
+
+    def release(self, key: tuple) -> None:
+        entry = self._get_entry(key)
+        with entry.lock:
+            entry.users = max(0, entry.users - 1)
+            if entry.users == 0 and entry.timer is not None:
+                entry.timer.cancel()
+                entry.timer = None
+
+    def get(self, key: tuple) -> dict:
+        entry = self._get_entry(key)
+        with entry.lock:
+            if entry.tokens is None or time.time() >= entry.refresh_at:
+                self._update(key, entry)
+            return entry.tokens
+
+    def invalidate(self, key: tuple, tokens: dict) -> dict:
+        """Called on a 401, logs in again unless another thread already replaced the rejected tokens."""
+        entry = self._get_entry(key)
+        with entry.lock:
+            if entry.tokens is tokens or entry.tokens is None:
+                entry.tokens = None
+                self._update(key, entry)
+            return entry.tokens
+
+    def _update(self, key: tuple, entry: TokenEntry) -> None:
+        tokens = None
+        if entry.tokens is not None and entry.refresh is not None:
+            try:
+                tokens = entry.refresh(entry.tokens)
+            except Exception:
+                tokens = None
+        if tokens is None:
+            tokens = entry.login()
+        expires = get_expiry(tokens.get("access", ""))
+        entry.tokens = tokens
+        now = time.time()
+        entry.expires = expires if expires is not None else now + self.ttl
+        # halfway through the lifetime at the latest, so short lived tokens are not refreshed in a loop
+        entry.refresh_at = max(entry.expires - self.margin, now + (entry.expires - now) / 2)
+        self._schedule(key, entry)
+
+    def _schedule(self, key: tuple, entry: TokenEntry) -> None:
+        if entry.timer is not None:
+            entry.timer.cancel()
+            entry.timer = None
+        if entry.users == 0:
+            return
+        entry.timer = threading.Timer(max(0.0, entry.refresh_at - time.time()), self._on_timer, (key,))
+        entry.timer.daemon = True
+        entry.timer.start()
+
+    def _on_timer(self, key: tuple) -> None:
+        entry = self._get_entry(key)
+        with entry.lock:
+            if entry.users == 0 or entry.tokens is None:
+                return
+            try:
+                self._update(key, entry)
+            except Exception:
+                # OVE is unreachable, the next request logs in again
+                entry.tokens = None
+                entry.timer = None
+
+    def clear(self) -> None:
+        with self.lock:
+            entries, self.entries = list(self.entries.values()), {}
+        for entry in entries:
+            with entry.lock:
+                if entry.timer is not None:
+                    entry.timer.cancel()
+                    entry.timer = None
+
+
+TOKEN_CACHE = TokenCache()
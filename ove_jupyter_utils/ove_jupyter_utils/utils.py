@@ -1,6 +1,8 @@
 import os
 import re
+import json
 import typing
+import hashlib
 
 from enum import Enum
 from dotenv import dotenv_values
@@ -29,6 +31,20 @@ def format_cell_name(cell_name: str) -> str:
     return f"{xs[0]}.{xs[1]}" if int(xs[1]) > 0 else f"{xs[0]}"
 
 
+def get_stale_keys(sections: dict, cell_no: int, total: int) -> list[str]:
+    # section keys are "{cell_no}-{i}", anything at or above the new output count is no longer displayed
+    return [k for k in sections.keys() if k.split("-")[0] == str(cell_no) and int(k.split("-")[1]) >= total]
+
+
+def get_fingerprint(*parts: typing.Any) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part if type(part) == str else json.dumps(part, sort_keys=True, default=str)
+        digest.update(encoded.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
 def get_app_url(section: dict) -> str:
     return section["data"]["app"]["url"]
 
@@ -49,7 +65,13 @@ def load_base_config(args: dict) -> dict:
         "sections": {},
         "mode": Mode(args.mode),
         "multi_controller": args.multi_controller,
-        "remove": args.remove
+        "remove": args.remove,
+        "pipeline": getattr(args, "pipeline", False),
+        "workers": getattr(args, "workers", 4),
+        "content_addressed": getattr(args, "content_addressed", False),
+        "downscale": getattr(args, "downscale", False),
+        "background": getattr(args, "background", False),
+        "tiles": getattr(args, "tiles", False)
     }
     # OVE_NEXT_CORE
     # OVE_USERNAME